@@ -0,0 +1,119 @@
+'''Check properties of the rendering code that the output relies on
+
+* The linear crossfade gives exactly the same result when it is stepped
+  from frame to frame as when it sums the window from scratch, so the
+  output doesn't depend on how frames are split between workers.
+* The cached glyphs of the info text give the same pixels as cairo's
+  show_text() at the fractional positions of the layouts.
+
+Prints each failed check and exits with an error if there are any.
+'''
+
+import argparse
+import os
+import random
+import sys
+
+import cairo
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from rendercore.blend import LinearBlender
+from rendercore.pixels import numpy
+from rendercore.render import CROSSFADE_RANGE
+from rendercore.text import FONT_NAME, FONT_NAME_SYMBOL, GlyphAtlas
+
+# Text drawn in the glyph check, at elfvideo's sidebar x and a few others
+GLYPH_CHECK_TEXTS = ((FONT_NAME_SYMBOL, '📆⏱📸'), (FONT_NAME, ' 2016-02-14 12:34:56 123d 05h'))
+GLYPH_CHECK_XS = (1193 + 1 / 3, 20.25, 20.5, 20.75)
+
+
+def check_linear_blender(num_frames=100, missing_rate=0.1, seed=1):
+    '''Return a description of the first frame whose stepped blend differs.'''
+    if not numpy:
+        return 'NumPy is not installed'
+
+    rng = numpy.random.RandomState(seed)
+    frames = [
+        None if rng.random_sample() < missing_rate else
+        rng.randint(0, 256, size=(8, 12, 4)).astype(numpy.uint8)
+        for _ in range(num_frames)
+    ]
+
+    def get_array(index):
+        if 0 <= index < num_frames:
+            return frames[index]
+
+    for step in (1, 2, 7):
+        stepped = LinearBlender(get_array, CROSSFADE_RANGE)
+
+        for index in range(0, num_frames, step):
+            expected = LinearBlender(get_array, CROSSFADE_RANGE).blend(index)
+            result = stepped.blend(index)
+
+            if expected is None or result is None:
+                if expected is not result:
+                    return 'frame {} stepping by {}: one of the blends is empty'.format(index, step)
+            elif not numpy.array_equal(expected, result):
+                return 'frame {} stepping by {}: differs by up to {}'.format(
+                    index, step, numpy.abs(expected - result).max())
+
+
+def check_glyph_atlas(size=20, seed=1):
+    '''Return a description of the first text the glyph atlas draws differently.'''
+    rng = random.Random(seed)
+
+    for font_name, text in GLYPH_CHECK_TEXTS:
+        atlas = GlyphAtlas(font_name, size)
+
+        for x in GLYPH_CHECK_XS:
+            y = 40 + rng.choice((0, 0.25, 0.5))
+            pixels = []
+
+            for draw in (atlas.show_text, atlas._show_text):
+                surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, 1920, 80)
+                context = cairo.Context(surface)
+                context.set_source_rgb(1.0, 1.0, 1.0)
+                draw(context, x, y, text)
+                surface.flush()
+                pixels.append(bytes(surface.get_data()))
+
+            if pixels[0] != pixels[1]:
+                return '{} at {:.2f}, {:.2f} differs from show_text()'.format(font_name, x, y)
+
+        if not atlas._phases:
+            return '{} is drawn with show_text() on cairo {}'.format(
+                font_name, cairo.cairo_version_string())
+
+
+CHECKS = {
+    'linear_blender': check_linear_blender,
+    'glyph_atlas': check_glyph_atlas,
+}
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--seed', type=int, default=random.randrange(1000000))
+
+    args = arg_parser.parse_args()
+
+    failures = []
+
+    for name, check in CHECKS.items():
+        failure = check(seed=args.seed)
+
+        if failure:
+            failures.append('{}: {}'.format(name, failure))
+
+    print('Seed {}: {} of {} checks failed'.format(args.seed, len(failures), len(CHECKS)))
+
+    for line in failures:
+        print('  ' + line)
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+'''Generated inputs shaped like the real ones for each video
+
+* Viet Crystal: a directory of 480x432 screenshots named by timestamp.
+* Ultra: a 7z archive of 240x160 ultra/ultra-N.png screenshots. Making
+  it needs 7-Zip like rendering it does.
+* PMD: 240x160 screenshots in NN/NNNNN.png directories, some of them
+  missing or recovered from a VOD, and a pmd_inputs database.
+'''
+
+import datetime
+import os
+import random
+import sqlite3
+import subprocess
+import tempfile
+
+import cairo
+
+START_TIMESTAMP = 1450000000
+PMD_VOTES = ('a', 'b', 'up', 'down', 'left', 'right', 'start', 'select', 'l', 'r')
+
+
+def draw_screenshot(width, height, rng):
+    '''Return a surface of random rectangles.'''
+    surface = cairo.ImageSurface(cairo.FORMAT_RGB24, width, height)
+    context = cairo.Context(surface)
+
+    for _ in range(20):
+        context.set_source_rgb(rng.random(), rng.random(), rng.random())
+        context.rectangle(
+            rng.randrange(width), rng.randrange(height),
+            rng.randrange(width // 4), rng.randrange(height // 4))
+        context.fill()
+
+    return surface
+
+
+def generate_elf_screenshots(input_dir, count, width=480, height=432, seed=1):
+    '''Write screenshots named by timestamp and return their filenames.'''
+    rng = random.Random(seed)
+    timestamp = START_TIMESTAMP
+    filenames = []
+
+    for index in range(count):
+        timestamp += rng.randrange(30, 600)
+        filename = '{}.png'.format(timestamp)
+        draw_screenshot(width, height, rng).write_to_png(os.path.join(input_dir, filename))
+        filenames.append(filename)
+
+    return tuple(filenames)
+
+
+def generate_ultra_archive(archive_filename, count, width=240, height=160, seed=1):
+    '''Write a 7z archive of numbered screenshots with spread out dates.'''
+    rng = random.Random(seed)
+    timestamp = START_TIMESTAMP
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        os.mkdir(os.path.join(temp_dir, 'ultra'))
+
+        for number in range(1, count + 1):
+            path = os.path.join(temp_dir, 'ultra', 'ultra-{}.png'.format(number))
+            draw_screenshot(width, height, rng).write_to_png(path)
+
+            timestamp += rng.randrange(30, 600)
+            os.utime(path, (timestamp, timestamp))
+
+        if os.path.exists(archive_filename):
+            os.remove(archive_filename)
+
+        # Store only; the real archive's PNGs don't compress further either
+        subprocess.check_call(
+            ['7z', 'a', '-mx=0', os.path.abspath(archive_filename), 'ultra'],
+            cwd=temp_dir, stdout=subprocess.DEVNULL
+        )
+
+
+def generate_pmd_inputs(images_dir, database_filename, count, width=240, height=160,
+                        missing_rate=0.02, vod_rate=0.02, seed=1):
+    '''Write input screenshots and a pmd_inputs table for them.'''
+    rng = random.Random(seed)
+    timestamp = START_TIMESTAMP
+    rows = []
+
+    for frame_id in range(1, count + 1):
+        timestamp += rng.randrange(10, 60) + rng.randrange(1000) / 1000
+        date_str = '{}.{:03d}'.format(
+            _format_timestamp(int(timestamp)), int(timestamp * 1000) % 1000)
+        rows.append((frame_id, date_str, rng.choice(PMD_VOTES), '[]', None))
+
+        chance = rng.random()
+
+        if chance < missing_rate:
+            continue
+
+        shard_dir = os.path.join(images_dir, '{:02d}'.format(frame_id // 1000))
+        os.makedirs(shard_dir, exist_ok=True)
+        suffix = '.v.png' if chance < missing_rate + vod_rate else '.png'
+
+        draw_screenshot(width, height, rng).write_to_png(
+            os.path.join(shard_dir, '{:05d}{}'.format(frame_id, suffix)))
+
+    if os.path.exists(database_filename):
+        os.remove(database_filename)
+
+    database = sqlite3.connect(database_filename)
+
+    try:
+        with database:
+            database.execute('''
+                CREATE TABLE pmd_inputs (
+                id INTEGER PRIMARY KEY,
+                date TEXT NOT NULL,
+                input TEXT NOT NULL,
+                voters TEXT NOT NULL,
+                imgur_id TEXT
+                )
+            ''')
+            database.executemany('INSERT INTO pmd_inputs VALUES (?, ?, ?, ?, ?)', rows)
+    finally:
+        database.close()
+
+
+def _format_timestamp(timestamp):
+    date = datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc)
+
+    return date.strftime('%Y-%m-%d %H:%M:%S')
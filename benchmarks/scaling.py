@@ -0,0 +1,86 @@
+'''Benchmark how rendering scales with worker threads and processes
+
+Renders Viet Crystal style frames from generated screenshots and prints
+frames per second for each worker count in thread and process mode.
+With --profile, it also prints how many times each screenshot was
+decoded on average, which is 1 when every worker's decoded frame window
+stays warm.
+Run it from the repository root so the icon images are found.
+'''
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import elfvideo
+from benchmarks.datasets import generate_elf_screenshots
+from rendercore.profile import Profiler
+from rendercore.scheduler import Scheduler
+from rendercore.sink import PNGSink
+from rendercore.source import DirectorySource
+from rendercore.timeline import build_timeline
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--frames', type=int, default=200)
+    arg_parser.add_argument('--max-workers', type=int, default=os.cpu_count())
+    arg_parser.add_argument('--profile', action='store_true',
+                            help='Also count the screenshot decodes')
+
+    args = arg_parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as input_dir, \
+            tempfile.TemporaryDirectory() as temp_dir:
+        input_filenames = generate_elf_screenshots(input_dir, args.frames)
+        num_render_frames = len(build_timeline(len(input_filenames), elfvideo.FPS))
+
+        print('mode\tworkers\tframes/s\tspeedup' + ('\tdecodes' if args.profile else ''))
+
+        for processes in (False, True):
+            baseline = None
+
+            for workers in worker_counts(args.max_workers):
+                output_dir = os.path.join(temp_dir, 'output-{}-{}'.format(
+                    'process' if processes else 'thread', workers))
+                os.mkdir(output_dir)
+                renderer = elfvideo.Renderer(DirectorySource(input_dir))
+                start_time = time.perf_counter()
+
+                profiler = Profiler(log_func=lambda line: None) if args.profile else None
+                scheduler = Scheduler(workers=workers, processes=processes,
+                                      log_func=lambda name: None, profiler=profiler)
+
+                with PNGSink(output_dir) as sink:
+                    renderer.run(sink, scheduler)
+
+                rate = num_render_frames / (time.perf_counter() - start_time)
+                shutil.rmtree(output_dir)
+                baseline = baseline or rate
+
+                line = '{}\t{}\t{:.2f}\t{:.2f}'.format(
+                    'process' if processes else 'thread', workers, rate, rate / baseline)
+
+                if profiler:
+                    line += '\t{:.2f}'.format(profiler.count('decode') / len(input_filenames))
+
+                print(line)
+
+
+def worker_counts(max_workers):
+    workers = 1
+
+    while workers < max_workers:
+        yield workers
+        workers *= 2
+
+    yield max_workers
+
+
+if __name__ == '__main__':
+    main()
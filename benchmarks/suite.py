@@ -0,0 +1,257 @@
+'''Benchmark each renderer stage by stage on generated inputs
+
+For each video, generates inputs (see datasets.py) and measures the
+throughput of decoding screenshots, drawing the info text, rendering
+the frames in one thread (which decodes the screenshots that fell out
+of the frame cache again), encoding them as PNG and rendering end to
+end with each worker count, with and without writing the frames.
+Results are appended to a JSON lines file and compared with the last
+run with the same settings, flagging slowdowns beyond the tolerance.
+
+Run it from the repository root so the icon images are found. The Ultra
+benchmark needs 7-Zip and is skipped without it.
+'''
+
+import argparse
+import datetime
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import cairo
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import elfvideo
+from benchmarks.datasets import generate_elf_screenshots, generate_pmd_inputs, \
+    generate_ultra_archive
+from benchmarks.scaling import worker_counts
+from pmdred import pmdvideo
+from rendercore.scheduler import Scheduler
+from rendercore.sink import NullSink, PNGSink
+from rendercore.source import ArchiveSource, DirectorySource, InputDatabaseSource
+from rendercore.text import draw_info_line
+from ultra import ultravideo
+
+RENDERERS = ('elf', 'ultra', 'pmd')
+DEFAULT_RESULTS_FILENAME = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results.jsonl')
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--frames', type=int, default=200)
+    arg_parser.add_argument('--max-workers', type=int, default=os.cpu_count())
+    arg_parser.add_argument('--processes', action='store_true',
+                            help='Render end to end in worker processes')
+    arg_parser.add_argument('--renderer', choices=RENDERERS, action='append',
+                            help='Only benchmark this renderer (can be repeated)')
+    arg_parser.add_argument('--results', default=DEFAULT_RESULTS_FILENAME,
+                            help='JSON lines file the results are appended to')
+    arg_parser.add_argument('--tolerance', type=float, default=0.1,
+                            help='Fraction of throughput that can be lost before '
+                                 'it is reported as a regression')
+
+    args = arg_parser.parse_args()
+    renderers = args.renderer or RENDERERS
+    previous_results = load_results(args.results)
+    regressions = []
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for name in renderers:
+            if name == 'ultra' and not shutil.which('7z'):
+                print('Skipping ultra: 7z not found')
+                continue
+
+            data_dir = os.path.join(temp_dir, name)
+            os.mkdir(data_dir)
+
+            print('Generating {} inputs for {}'.format(args.frames, name))
+            make_renderer = generate_dataset(name, data_dir, args.frames)
+
+            result = {
+                'date': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                'commit': git_commit(),
+                'renderer': name,
+                'frames': args.frames,
+                'processes': args.processes,
+                'throughput': measure(make_renderer, data_dir, args),
+            }
+
+            previous = find_previous(previous_results, result)
+            regressions.extend(report(result, previous, args.tolerance))
+            save_result(args.results, result)
+
+    if regressions:
+        print('Regressions:')
+
+        for line in regressions:
+            print('  ' + line)
+
+        sys.exit(1)
+
+
+def generate_dataset(name, data_dir, count):
+    '''Write the inputs and return a function making a renderer for them.'''
+    if name == 'elf':
+        input_dir = os.path.join(data_dir, 'input')
+        os.mkdir(input_dir)
+        generate_elf_screenshots(input_dir, count)
+
+        return lambda: elfvideo.Renderer(DirectorySource(input_dir))
+    elif name == 'ultra':
+        archive_filename = os.path.join(data_dir, 'ultra.7z')
+        generate_ultra_archive(archive_filename, count)
+
+        return lambda: ultravideo.Renderer(ArchiveSource(
+            archive_filename, ultravideo.ARCHIVE_ORDER_PATTERN,
+            cache_dir=os.path.join(data_dir, 'cache')))
+    else:
+        images_dir = os.path.join(data_dir, 'images')
+        database_filename = os.path.join(data_dir, 'inputs.db')
+        generate_pmd_inputs(images_dir, database_filename, count)
+
+        return lambda: pmdvideo.Renderer(InputDatabaseSource(images_dir, database_filename))
+
+
+def measure(make_renderer, data_dir, args):
+    '''Return items per second for each stage.'''
+    throughput = {}
+
+    renderer = make_renderer()
+    jobs = renderer.plan()
+    source = renderer.source
+
+    start_time = time.perf_counter()
+
+    for index in range(len(source)):
+        source.load(index)
+
+    throughput['decode'] = len(source) / (time.perf_counter() - start_time)
+
+    layout = renderer.layout
+    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, layout.width, layout.height)
+    context = cairo.Context(surface)
+    start_time = time.perf_counter()
+
+    for job in jobs:
+        for line, (symbol, text) in enumerate(job.info_lines):
+            draw_info_line(context, layout, line, symbol, text)
+
+    throughput['text'] = len(jobs) / (time.perf_counter() - start_time)
+
+    composite_seconds = 0
+    encode_seconds = 0
+
+    for job in jobs:
+        start_time = time.perf_counter()
+        frame = renderer.render(job)
+        composite_seconds += time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        frame.write_to_png(io.BytesIO())
+        encode_seconds += time.perf_counter() - start_time
+
+    throughput['composite'] = len(jobs) / composite_seconds
+    throughput['encode'] = len(jobs) / encode_seconds
+
+    num_render_frames = sum(len(job.render_indexes) for job in jobs)
+
+    for workers in worker_counts(args.max_workers):
+        output_dir = os.path.join(data_dir, 'output-{}'.format(workers))
+        os.mkdir(output_dir)
+        renderer = make_renderer()
+        scheduler = Scheduler(workers=workers, processes=args.processes,
+                              log_func=lambda name: None)
+
+        start_time = time.perf_counter()
+
+        with PNGSink(output_dir) as sink:
+            renderer.run(sink, scheduler)
+
+        throughput['end_to_end_{}'.format(workers)] = \
+            num_render_frames / (time.perf_counter() - start_time)
+
+        shutil.rmtree(output_dir)
+
+        # Without encoding and writing, to see what rendering alone can do
+        renderer = make_renderer()
+        start_time = time.perf_counter()
+
+        with NullSink() as sink:
+            renderer.run(sink, scheduler)
+
+        throughput['no_output_{}'.format(workers)] = \
+            num_render_frames / (time.perf_counter() - start_time)
+
+    return throughput
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_results(filename):
+    results = []
+
+    try:
+        with open(filename) as file:
+            for line in file:
+                try:
+                    results.append(json.loads(line))
+                except ValueError:
+                    pass
+    except FileNotFoundError:
+        pass
+
+    return results
+
+
+def find_previous(results, result):
+    for previous in reversed(results):
+        if all(previous.get(key) == result[key] for key in ('renderer', 'frames', 'processes')):
+            return previous
+
+
+def save_result(filename, result):
+    with open(filename, 'a') as file:
+        file.write(json.dumps(result, sort_keys=True) + '\n')
+
+
+def report(result, previous, tolerance):
+    '''Print the throughput of each stage and return the regressions.'''
+    regressions = []
+    previous_throughput = previous['throughput'] if previous else {}
+
+    print('{}\tstage\tper second\tchange'.format(result['renderer']))
+
+    for stage, rate in sorted(result['throughput'].items()):
+        previous_rate = previous_throughput.get(stage)
+
+        if previous_rate:
+            change = rate / previous_rate - 1
+            change_text = '{:+.1%}'.format(change)
+
+            if change < -tolerance:
+                regressions.append('{} {}: {:.2f} -> {:.2f} ({})'.format(
+                    result['renderer'], stage, previous_rate, rate, change_text))
+        else:
+            change_text = '-'
+
+        print('\t{}\t{:.2f}\t{}'.format(stage, rate, change_text))
+
+    return regressions
+
+
+if __name__ == '__main__':
+    main()
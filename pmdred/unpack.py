@@ -1,24 +1,22 @@
 import argparse
+import concurrent.futures
 import datetime
-import hashlib
 import json
 import os
-import re
 import subprocess
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from rendercore.catalog import load_catalog
+from rendercore.verify import file_sha1
 
 ARCHIVE_SHA1_HASH = 'b16d113adfedd23739af27a9a6bd8e48236c4343'
+ARCHIVE_ORDER_PATTERN = r'pmdrrt/pmdrrt-(\d+)\.png'
 
 
 def check_archive(filename):
-    hasher = hashlib.sha1()
-    with open(filename, 'rb') as file:
-        while True:
-            data = file.read(4096)
-            if not data:
-                break
-            hasher.update(data)
-
-    if hasher.hexdigest().lower() != ARCHIVE_SHA1_HASH.lower():
+    if file_sha1(filename).lower() != ARCHIVE_SHA1_HASH.lower():
         raise Exception(
             'Archive file hash does not match the one Felkcraft has released.'
         )
@@ -39,40 +37,19 @@ def main():
 
     args = arg_parser.parse_args()
 
-    print('Checking archive')
-    check_archive(args.input_archive)
-
-    print('Reading archive listing')
-    # Important: Force 7zip to display in UTC using environment variable
-    output = subprocess.check_output(
-        ['7z', 'l', args.input_archive, '-slt', '-ba'],
-        env={'TZ': ''}
-    )
-
-    infos = []
-    info = {}
-
-    for line in output.splitlines(keepends=False):
-        line = line.decode()
-
-        if line.startswith('Path = '):
-            info['path'] = line[7:]
-
-        elif line.startswith('Modified = '):
-            info['modified'] = datetime.datetime.strptime(line[11:],
-                                                          '%Y-%m-%d %H:%M:%S')
-        elif not line:
-            assert 'path' in info, info
-            assert 'modified' in info, info
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        print('Checking archive')
+        check_future = executor.submit(check_archive, args.input_archive)
 
-            if info['path'].endswith('.png'):
-                info['index'] = int(
-                    re.match(r'pmdrrt/pmdrrt-(\d+)\.png', info['path']).group(1)
-                )
+        print('Reading archive listing')
+        entries = load_catalog(args.input_archive, ARCHIVE_ORDER_PATTERN)
 
-                infos.append(info)
+        check_future.result()
 
-            info = {}
+    infos = [
+        {'path': entry.path, 'modified': entry.modified, 'index': entry.frame_number}
+        for entry in entries if entry.frame_number is not None
+    ]
 
     print('Extracting')
 
@@ -0,0 +1 @@
+'''Rendering code shared by the timelapse compilation video scripts'''
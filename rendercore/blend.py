@@ -0,0 +1,289 @@
+'''Sidebar crossfade of neighboring input frames'''
+
+import threading
+
+import cairo
+
+from rendercore.pixels import numpy, surface_pixels
+
+MODES = ('cairo', 'over', 'linear')
+DEFAULT_MODE = 'over' if numpy else 'cairo'
+
+
+def crossfade_weight(offset, crossfade_range):
+    if offset < 0:
+        weight = 1 - offset / crossfade_range[0]
+    elif offset > 0:
+        weight = 1 - offset / crossfade_range[1]
+    else:
+        weight = 1
+
+    return weight
+
+
+def array_to_surface(array):
+    '''Round a float array of premultiplied BGRA into a new ARGB32 surface.'''
+    height, width = array.shape[:2]
+    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
+    surface_pixels(surface)[:] = numpy.clip(numpy.rint(array), 0, 255).astype(numpy.uint8)
+    surface.mark_dirty()
+
+    return surface
+
+
+class Crossfade:
+    '''Paints the neighbors of an input frame faded on top of each other.
+
+    Modes:
+
+    * cairo: paint each neighbor with its weight, the original method.
+      The neighbors are painted onto a surface at the input resolution
+      which is scaled once, so it needs neither NumPy nor a scaled paint
+      per neighbor.
+    * over: same result as cairo (within rounding) but the neighbors are
+      blended with NumPy.
+    * linear: a weighted average using the crossfade weights directly.
+      The sum is kept up to date as frames are stepped through in order so
+      the cost doesn't depend on the crossfade range. It looks slightly
+      different from the other modes which apply each neighbor on top of
+      the previous ones. It only pays off when a worker renders
+      consecutive frames, as with --processes; threads take turns on
+      the frames, so each one mostly sums its window from scratch.
+
+    The NumPy modes read the pixels of the decoded frames directly and
+    convert them to floats as they are blended, so they keep no copies.
+
+    With a stride, only every stride-th frame is shown, and the
+    neighbors are the shown frames around it: the offsets of the range
+    are multiplied by the stride.
+    '''
+    def __init__(self, frame_cache, num_frames, crossfade_range, mode=DEFAULT_MODE, stride=1):
+        if mode not in MODES:
+            raise ValueError('Unknown crossfade mode {}'.format(mode))
+
+        if mode != 'cairo' and not numpy:
+            raise ValueError('NumPy is required for crossfade mode {}'.format(mode))
+
+        self._frame_cache = frame_cache
+        self._num_frames = num_frames
+        self._crossfade_range = crossfade_range
+        self._mode = mode
+        self._stride = stride
+        self._weights = tuple(
+            (offset * stride, crossfade_weight(offset, crossfade_range) / 2)
+            for offset in range(crossfade_range[0], crossfade_range[1] + 1)
+        )
+        self._local = threading.local()
+
+    def _get_array(self, index):
+        if 0 <= index < self._num_frames:
+            surface = self._frame_cache.get(index)
+
+            if surface is not None:
+                return surface_pixels(surface)
+
+    def _get_strided_array(self, position):
+        return self._get_array(position * self._stride)
+
+    def paint(self, context, index, x, y, scale):
+        if self._mode == 'cairo':
+            self._paint_cairo(context, index, x, y, scale)
+            return
+
+        if self._mode == 'over':
+            array = self._blend_over(index)
+        else:
+            blender = getattr(self._local, 'blender', None)
+
+            if not blender:
+                blender = self._local.blender = LinearBlender(
+                    self._get_strided_array, self._crossfade_range)
+
+            array = blender.blend(index // self._stride)
+
+        if array is None:
+            return
+
+        context.save()
+        context.translate(x, y)
+        context.scale(scale, scale)
+        context.set_source_surface(array_to_surface(array), 0, 0)
+        context.get_source().set_filter(cairo.FILTER_NEAREST)
+        context.paint()
+        context.restore()
+
+    def _paint_cairo(self, context, index, x, y, scale):
+        # Fade the neighbors together at the input resolution and scale
+        # the result once instead of painting every neighbor scaled
+        blended = None
+
+        for offset, weight in self._weights:
+            sub_index = index + offset
+
+            if sub_index < 0 or sub_index >= self._num_frames:
+                continue
+
+            sub_input_surface = self._frame_cache.get(sub_index)
+
+            if sub_input_surface is None:
+                continue
+
+            if blended is None:
+                blended = cairo.ImageSurface(cairo.FORMAT_ARGB32, sub_input_surface.get_width(),
+                                             sub_input_surface.get_height())
+                blended_context = cairo.Context(blended)
+
+            blended_context.set_source_surface(sub_input_surface, 0, 0)
+            blended_context.paint_with_alpha(weight)
+
+        if blended is None:
+            return
+
+        blended.flush()
+
+        context.save()
+        context.translate(x, y)
+        context.scale(scale, scale)
+        context.set_source_surface(blended, 0, 0)
+        context.get_source().set_filter(cairo.FILTER_NEAREST)
+        context.paint()
+        context.restore()
+
+    def _blend_over(self, index):
+        # Same as cairo's OVER operator applied once per neighbor
+        result = None
+
+        for offset, weight in self._weights:
+            array = self._get_array(index + offset)
+
+            if array is None:
+                continue
+
+            weight = numpy.float32(weight)
+
+            if result is None:
+                result = array * weight
+            else:
+                result *= 1 - array[:, :, 3:4] * (weight / 255)
+                result += array * weight
+
+        return result
+
+
+class LinearBlender:
+    '''Weighted average of neighboring frames using running sums.
+
+    The weights rise linearly from the start of the crossfade range up to
+    the current frame and fall linearly to the end of the range. For each
+    side, the sum of the frames and the sum of the frames multiplied by
+    their index are enough to compute the weighted sum. Moving to the next
+    frame only adds and removes a few frames from these sums.
+
+    The sums are exact integers, so the result is the same whether it
+    was stepped to or summed from scratch. A jump that would take more
+    work to step through than summing the window starts over instead.
+
+    Frames that are missing count as zero weight.
+    '''
+    def __init__(self, get_array, crossfade_range):
+        self._get_array = get_array
+        self._before = -crossfade_range[0]
+        self._after = crossfade_range[1]
+        self._index = None
+
+    def blend(self, index):
+        # Each step adds and removes two frames on each side while summing
+        # from scratch adds each frame of the window once
+        if self._index is not None and \
+                0 <= (index - self._index) * 4 <= self._before + self._after + 1:
+            while self._index < index:
+                self._step()
+        else:
+            self._seed(index)
+
+        return self._result()
+
+    def _seed(self, index):
+        self._index = index
+        self._past = _RunningSum()
+        self._future = _RunningSum()
+
+        for sub_index in range(index - self._before, index + 1):
+            self._past.add(self._get_array(sub_index), sub_index)
+
+        for sub_index in range(index + 1, index + self._after + 1):
+            self._future.add(self._get_array(sub_index), sub_index)
+
+    def _step(self):
+        index = self._index
+        next_array = self._get_array(index + 1)
+
+        self._past.remove(self._get_array(index - self._before), index - self._before)
+        self._past.add(next_array, index + 1)
+
+        if self._after:
+            self._future.remove(next_array, index + 1)
+            self._future.add(self._get_array(index + 1 + self._after), index + 1 + self._after)
+
+        self._index += 1
+
+    def _result(self):
+        # The weights of each side are fractions of its length, so scale
+        # both sides to a common denominator to keep to integers
+        index = self._index
+        past_scale = self._after or 1
+        future_scale = self._before or 1
+
+        if self._before:
+            start = index - self._before
+            total = self._past.weighted_sum(-start, 1)
+            weight = self._past.weighted_count(-start, 1)
+        else:
+            total = self._past.total
+            weight = self._past.count
+
+        total = total * past_scale
+        weight = weight * past_scale
+
+        if self._after:
+            end = index + self._after
+            total = total + self._future.weighted_sum(end, -1) * future_scale
+            weight += self._future.weighted_count(end, -1) * future_scale
+
+        if weight <= 0:
+            return None
+
+        return total / weight
+
+
+class _RunningSum:
+    '''Sums of arrays and of arrays multiplied by their position.'''
+    def __init__(self):
+        self.total = 0
+        self.moment = 0
+        self.count = 0
+        self.position_sum = 0
+
+    def add(self, array, position, sign=1):
+        if array is None:
+            return
+
+        array = array.astype(numpy.int64)
+
+        if sign < 0:
+            array = -array
+
+        self.total = self.total + array
+        self.moment = self.moment + position * array
+        self.count += sign
+        self.position_sum += sign * position
+
+    def remove(self, array, position):
+        self.add(array, position, sign=-1)
+
+    def weighted_sum(self, offset, sign):
+        # Sum of (offset + sign * position) * array
+        return offset * self.total + sign * self.moment
+
+    def weighted_count(self, offset, sign):
+        return offset * self.count + sign * self.position_sum
@@ -0,0 +1,63 @@
+'''Decoded input frame cache shared by the render workers'''
+
+import concurrent.futures
+import logging
+import threading
+
+import cairo
+
+DEFAULT_MAX_SIZE = 256
+
+
+def load_png(path):
+    '''Decode a PNG file into a surface.
+
+    Returns None if the image could not be read.
+    '''
+    try:
+        return cairo.ImageSurface.create_from_png(path)
+    except OSError:
+        logging.exception('Image error on {}'.format(path))
+
+
+class FrameCache:
+    '''Bounded window of decoded input frames keyed by input index.
+
+    Frames are rendered roughly in input order and each one needs its
+    crossfade neighbors, so a frame is decoded once and reused by the
+    following frames. When the cache is full, the lowest index is evicted.
+
+    A worker asking for a frame that another worker is already decoding
+    waits for that result instead of decoding it again. Failed decodes
+    (None) are cached too.
+    '''
+    def __init__(self, load_func, max_size=DEFAULT_MAX_SIZE):
+        self._load_func = load_func
+        self._max_size = max_size
+        self._lock = threading.Lock()
+        self._futures = {}
+
+    def get(self, index, *args):
+        with self._lock:
+            future = self._futures.get(index)
+
+            if future:
+                is_owner = False
+            else:
+                is_owner = True
+                future = self._futures[index] = concurrent.futures.Future()
+
+                while len(self._futures) > self._max_size:
+                    del self._futures[min(self._futures)]
+
+        if is_owner:
+            try:
+                future.set_result(self._load_func(index, *args))
+            except Exception as error:
+                with self._lock:
+                    if self._futures.get(index) is future:
+                        del self._futures[index]
+
+                future.set_exception(error)
+
+        return future.result()
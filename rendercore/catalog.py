@@ -0,0 +1,159 @@
+'''Listing of the members of a 7z archive kept in a sidecar database'''
+
+import collections
+import datetime
+import os
+import re
+import sqlite3
+import subprocess
+
+CATALOG_SUFFIX = '.catalog'
+CATALOG_VERSION = '1'
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+ArchiveEntry = collections.namedtuple('ArchiveEntry', [
+    'path', 'modified', 'crc', 'size', 'offset', 'frame_number'
+])
+'''A file in the archive.
+
+Modified is in UTC. Offset is where the file starts in the output of
+`7z e -so`. Frame number is the number captured by the order pattern
+from the path, or None if the path doesn't match.
+'''
+
+
+def list_archive(filename, order_pattern):
+    '''Return the files in the archive in archive order.'''
+    # Important: Force 7zip to display in UTC using environment variable
+    output = subprocess.check_output(['7z', 'l', filename, '-slt', '-ba'], env={'TZ': ''})
+    entries = []
+    offset = 0
+
+    info = {}
+
+    for line in output.splitlines(keepends=False):
+        line = line.decode()
+        if line.startswith('Path = '):
+            info['path'] = line[7:]
+        elif line.startswith('Modified = '):
+            info['modified'] = datetime.datetime.strptime(line[11:], '%Y-%m-%d %H:%M:%S')
+        elif line.startswith('CRC = '):
+            info['crc'] = line[6:]
+        elif line.startswith('Size = '):
+            info['size'] = int(line[7:])
+        elif line == 'Folder = +':
+            info['folder'] = True
+        elif not line:
+            assert 'path' in info, info
+            assert 'modified' in info, info
+
+            if not info.get('folder'):
+                match = re.match(order_pattern, info['path'])
+                size = info.get('size', 0)
+
+                entries.append(ArchiveEntry(
+                    info['path'], info['modified'], info.get('crc'), size, offset,
+                    int(match.group(1)) if match else None
+                ))
+                offset += size
+
+            info = {}
+
+    return entries
+
+
+def _catalog_key(filename, order_pattern):
+    stat = os.stat(filename)
+
+    return {
+        'version': CATALOG_VERSION,
+        'size': str(stat.st_size),
+        'mtime_ns': str(stat.st_mtime_ns),
+        'inode': str(stat.st_ino),
+        'order_pattern': order_pattern,
+    }
+
+
+def load_catalog(filename, order_pattern):
+    '''Return the files in the archive, listing it only if it changed.
+
+    The listing is saved in a sqlite database next to the archive along
+    with the size, modification time and inode of the archive.
+    '''
+    catalog_filename = filename + CATALOG_SUFFIX
+    key = _catalog_key(filename, order_pattern)
+
+    if os.path.exists(catalog_filename):
+        entries = _read_catalog(catalog_filename, key)
+
+        if entries is not None:
+            return entries
+
+    entries = list_archive(filename, order_pattern)
+
+    try:
+        _write_catalog(catalog_filename, key, entries)
+    except (OSError, sqlite3.Error):
+        # Such as when the archive is on a read only disk
+        pass
+
+    return entries
+
+
+def _read_catalog(catalog_filename, key):
+    database = sqlite3.connect(catalog_filename)
+
+    try:
+        if dict(database.execute('SELECT key, value FROM meta')) != key:
+            return None
+
+        return [
+            ArchiveEntry(path, EPOCH + datetime.timedelta(seconds=modified), crc, size, offset,
+                         frame_number)
+            for path, modified, crc, size, offset, frame_number in database.execute('''
+                SELECT path, modified, crc, size, offset, frame_number
+                FROM members ORDER BY position
+            ''')
+        ]
+    except sqlite3.Error:
+        return None
+    finally:
+        database.close()
+
+
+def _write_catalog(catalog_filename, key, entries):
+    temp_filename = catalog_filename + '.tmp'
+
+    if os.path.exists(temp_filename):
+        os.remove(temp_filename)
+
+    database = sqlite3.connect(temp_filename)
+
+    try:
+        with database:
+            database.execute('CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)')
+            database.execute('''
+                CREATE TABLE members (
+                    position INTEGER PRIMARY KEY,
+                    path TEXT,
+                    modified INTEGER,
+                    crc TEXT,
+                    size INTEGER,
+                    offset INTEGER,
+                    frame_number INTEGER
+                )
+            ''')
+            database.executemany('INSERT INTO meta VALUES (?, ?)', key.items())
+            database.executemany(
+                'INSERT INTO members VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (
+                    (position, entry.path, int((entry.modified - EPOCH).total_seconds()),
+                     entry.crc, entry.size, entry.offset, entry.frame_number)
+                    for position, entry in enumerate(entries)
+                )
+            )
+    finally:
+        database.close()
+
+    os.replace(temp_filename, catalog_filename)
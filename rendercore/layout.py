@@ -0,0 +1,97 @@
+'''Positions of the elements on the output frame'''
+
+import collections
+
+WIDTH = 1920
+HEIGHT = 1080
+PADDING = 30
+TITLE_TEXT_SIZE = 55
+INFO_TEXT_SIZE = 50
+
+Layout = collections.namedtuple('Layout', [
+    'width', 'height', 'padding',
+    'frame_width', 'frame_height',
+    'screenshot_x', 'screenshot_y', 'screenshot_scale',
+    'sidebar_x', 'sidebar_y', 'sidebar_scale',
+    'title_x', 'title_y', 'title_text_size', 'title_centered',
+    'info_y', 'info_text_size',
+    'scale',
+])
+'''Where the screenshot, the crossfaded sidebar and the text go.
+
+Lines of info text start at info_y in the sidebar, one per line_y().
+Scale is the size of the frame relative to a full size layout.
+'''
+
+
+def line_y(layout, line):
+    '''Baseline of a line of info text.'''
+    return layout.info_y + line * (layout.padding + layout.info_text_size)
+
+
+def sidebar_layout(frame_width, frame_height):
+    '''Screenshot filling the height of the frame with the title in the sidebar.'''
+    screenshot_scale = (HEIGHT - PADDING * 2) / frame_height
+    sidebar_x = PADDING + frame_width * screenshot_scale + PADDING
+    sidebar_scale = (WIDTH - PADDING - sidebar_x) / frame_width
+    title_y = PADDING + TITLE_TEXT_SIZE
+
+    return Layout(
+        width=WIDTH, height=HEIGHT, padding=PADDING,
+        frame_width=frame_width, frame_height=frame_height,
+        screenshot_x=PADDING, screenshot_y=PADDING, screenshot_scale=screenshot_scale,
+        sidebar_x=sidebar_x,
+        sidebar_y=HEIGHT - PADDING - frame_height * sidebar_scale,
+        sidebar_scale=sidebar_scale,
+        title_x=sidebar_x, title_y=title_y,
+        title_text_size=TITLE_TEXT_SIZE, title_centered=False,
+        info_y=title_y + PADDING * 2 + INFO_TEXT_SIZE,
+        info_text_size=INFO_TEXT_SIZE,
+        scale=1,
+    )
+
+
+def title_bar_layout(frame_width, frame_height, screenshot_scale=5):
+    '''Title centered across the top with the screenshot below it.'''
+    title_y = PADDING + TITLE_TEXT_SIZE
+    screenshot_y = title_y + PADDING * 2
+    sidebar_x = PADDING + frame_width * screenshot_scale + PADDING
+    sidebar_scale = (WIDTH - PADDING - sidebar_x) / frame_width
+
+    return Layout(
+        width=WIDTH, height=HEIGHT, padding=PADDING,
+        frame_width=frame_width, frame_height=frame_height,
+        screenshot_x=PADDING, screenshot_y=screenshot_y, screenshot_scale=screenshot_scale,
+        sidebar_x=sidebar_x,
+        sidebar_y=screenshot_y + frame_height * screenshot_scale - frame_height * sidebar_scale,
+        sidebar_scale=sidebar_scale,
+        title_x=(WIDTH - PADDING * 2) / 2, title_y=title_y,
+        title_text_size=TITLE_TEXT_SIZE, title_centered=True,
+        info_y=screenshot_y + INFO_TEXT_SIZE,
+        info_text_size=INFO_TEXT_SIZE,
+        scale=1,
+    )
+
+
+def scale_layout(layout, scale):
+    '''Shrink or enlarge everything on the frame, such as for a preview.'''
+    if scale == 1:
+        return layout
+
+    return layout._replace(
+        width=round(layout.width * scale),
+        height=round(layout.height * scale),
+        padding=layout.padding * scale,
+        screenshot_x=layout.screenshot_x * scale,
+        screenshot_y=layout.screenshot_y * scale,
+        screenshot_scale=layout.screenshot_scale * scale,
+        sidebar_x=layout.sidebar_x * scale,
+        sidebar_y=layout.sidebar_y * scale,
+        sidebar_scale=layout.sidebar_scale * scale,
+        title_x=layout.title_x * scale,
+        title_y=layout.title_y * scale,
+        title_text_size=layout.title_text_size * scale,
+        info_y=layout.info_y * scale,
+        info_text_size=layout.info_text_size * scale,
+        scale=layout.scale * scale,
+    )
@@ -0,0 +1,91 @@
+'''Record of what each output frame was rendered from'''
+
+import os
+import threading
+
+MANIFEST_FILENAME = 'manifest.txt'
+
+
+class Manifest:
+    '''Digest of the dependencies of each written output frame.
+
+    The file has a line of "render_index digest" for each frame. Lines
+    are appended as frames are written, after the frame itself is in
+    place, and later lines replace earlier ones. A run that is
+    interrupted leaves the manifest describing the frames that were
+    completely written. The file is rewritten without the replaced
+    lines when it is loaded.
+
+    Worker processes get a copy that only appends.
+    '''
+    def __init__(self, filename):
+        self._filename = filename
+        self._lock = threading.Lock()
+        self._file = None
+        self._digests = {}
+
+        if os.path.exists(filename):
+            self._load()
+
+    def __getstate__(self):
+        return {'_filename': self._filename}
+
+    def __setstate__(self, state):
+        self._filename = state['_filename']
+        self._lock = threading.Lock()
+        self._file = None
+        self._digests = {}
+
+    def _load(self):
+        num_lines = 0
+        num_bad_lines = 0
+
+        with open(self._filename) as file:
+            for line in file:
+                fields = line.split()
+
+                # Line cut short by a crash
+                if len(fields) != 2 or not line.endswith('\n'):
+                    num_bad_lines += 1
+                    continue
+
+                self._digests[int(fields[0])] = fields[1]
+                num_lines += 1
+
+        # Appending after a partial line would garble the next line
+        if num_bad_lines or num_lines != len(self._digests):
+            self._compact()
+
+    def _compact(self):
+        temp_filename = self._filename + '.tmp'
+
+        with open(temp_filename, 'w') as file:
+            for render_index in sorted(self._digests):
+                file.write('{} {}\n'.format(render_index, self._digests[render_index]))
+
+        os.replace(temp_filename, self._filename)
+
+    def get(self, render_index):
+        return self._digests.get(render_index)
+
+    def render_indexes(self):
+        return tuple(self._digests)
+
+    def record(self, render_indexes, digest):
+        lines = ''.join('{} {}\n'.format(render_index, digest) for render_index in render_indexes)
+
+        with self._lock:
+            if not self._file:
+                self._file = open(self._filename, 'a')
+
+            self._file.write(lines)
+            self._file.flush()
+
+            for render_index in render_indexes:
+                self._digests[render_index] = digest
+
+    def close(self):
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
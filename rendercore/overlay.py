@@ -0,0 +1,85 @@
+'''Overlay graphics that don't change from frame to frame'''
+
+import functools
+import math
+import threading
+
+import cairo
+
+# Extra pixels around the drawn area in case the ink extents are off
+# a bit from antialiasing
+LAYER_MARGIN = 2
+
+
+@functools.lru_cache()
+def load_asset(path):
+    '''Decode an image asset once and share it.'''
+    return cairo.ImageSurface.create_from_png(path)
+
+
+def fade_in_alpha(index, start_index, duration):
+    '''Opacity of an element that fades in over duration frames.'''
+    if index < start_index:
+        return 0.0
+    elif index <= start_index + duration:
+        return (index - start_index) / duration
+    else:
+        return 1.0
+
+
+class OverlayLayer:
+    '''Precomposed overlay painted onto the frame with a single paint.
+
+    The draw function is called with a context and a state (such as the
+    opacity of an element that fades in) and only when that state hasn't
+    been drawn before. The result is cropped to the drawn area.
+
+    Painting the layer onto a transparent group gives the same pixels as
+    drawing it directly, as long as nothing drawn afterwards overlaps it.
+    '''
+    def __init__(self, width, height, draw_func):
+        self._width = width
+        self._height = height
+        self._draw_func = draw_func
+        self._lock = threading.Lock()
+        self._layers = {}
+
+    def paint(self, context, *state):
+        with self._lock:
+            layer = self._layers.get(state)
+
+            if not layer:
+                layer = self._layers[state] = self._render(state)
+
+        surface, x, y = layer
+
+        if surface is None:
+            return
+
+        context.save()
+        context.set_source_surface(surface, x, y)
+        context.paint()
+        context.restore()
+
+    def _render(self, state):
+        recording = cairo.RecordingSurface(
+            cairo.CONTENT_COLOR_ALPHA, (0, 0, self._width, self._height))
+        self._draw_func(cairo.Context(recording), *state)
+
+        ink_x, ink_y, ink_width, ink_height = recording.ink_extents()
+
+        if ink_width <= 0 or ink_height <= 0:
+            return None, 0, 0
+
+        x = max(0, math.floor(ink_x) - LAYER_MARGIN)
+        y = max(0, math.floor(ink_y) - LAYER_MARGIN)
+        width = min(self._width, math.ceil(ink_x + ink_width) + LAYER_MARGIN) - x
+        height = min(self._height, math.ceil(ink_y + ink_height) + LAYER_MARGIN) - y
+
+        surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
+        context = cairo.Context(surface)
+        context.translate(-x, -y)
+        self._draw_func(context, *state)
+        surface.flush()
+
+        return surface, x, y
@@ -0,0 +1,241 @@
+'''Screenshots kept in memory as palette indexes'''
+
+import collections
+import concurrent.futures
+import hashlib
+import mmap
+import os
+import tempfile
+import threading
+
+import cairo
+
+from rendercore.pixels import numpy, surface_pixels
+
+# Alignment of the arrays in the palette file
+ALIGNMENT = 8
+
+PaletteEntry = collections.namedtuple('PaletteEntry', [
+    'format', 'width', 'height', 'palette_offset', 'palette_size', 'indexes_offset', 'dtype'
+])
+'''Where a paletted screenshot is in the palette file.
+
+A palette size of 0 means the indexes are the ARGB values themselves.
+'''
+
+
+class PalettedFrame:
+    '''A screenshot as a palette of ARGB values and an index per pixel.
+
+    Screenshots with more colors than fit in 16 bit indexes keep their
+    pixels as they are.
+    '''
+    __slots__ = ('format', 'palette', 'indexes')
+
+    def __init__(self, surface_format, palette, indexes):
+        self.format = surface_format
+        self.palette = palette
+        self.indexes = indexes
+
+    @classmethod
+    def from_surface(cls, surface):
+        pixels = numpy.ascontiguousarray(surface_pixels(surface))
+        colors = pixels.view(numpy.uint32).reshape(pixels.shape[:2])
+        palette, indexes = numpy.unique(colors, return_inverse=True)
+
+        if len(palette) <= 0x100:
+            return cls(surface.get_format(), palette,
+                       indexes.astype(numpy.uint8).reshape(colors.shape))
+        elif len(palette) <= 0x10000:
+            return cls(surface.get_format(), palette,
+                       indexes.astype(numpy.uint16).reshape(colors.shape))
+        else:
+            return cls(surface.get_format(), None, colors)
+
+    @classmethod
+    def from_buffer(cls, buffer, entry):
+        '''Return a frame viewing the arrays of an entry in a buffer.'''
+        if entry.palette_size:
+            palette = numpy.frombuffer(buffer, numpy.uint32, entry.palette_size,
+                                       entry.palette_offset)
+        else:
+            palette = None
+
+        indexes = numpy.frombuffer(buffer, entry.dtype, entry.width * entry.height,
+                                   entry.indexes_offset)
+
+        return cls(cairo.Format(entry.format), palette,
+                   indexes.reshape(entry.height, entry.width))
+
+    @property
+    def nbytes(self):
+        return self.indexes.nbytes + (self.palette.nbytes if self.palette is not None else 0)
+
+    def digest(self):
+        hasher = hashlib.sha1(self.indexes.tobytes())
+
+        if self.palette is not None:
+            hasher.update(self.palette.tobytes())
+
+        return hasher.digest()
+
+    def write(self, file):
+        '''Append the arrays to a file and return their entry.'''
+        if self.palette is not None:
+            palette_offset = _write_aligned(file, self.palette)
+            palette_size = len(self.palette)
+        else:
+            palette_offset = palette_size = 0
+
+        height, width = self.indexes.shape
+        indexes_offset = _write_aligned(file, self.indexes)
+
+        return PaletteEntry(int(self.format), width, height, palette_offset, palette_size,
+                            indexes_offset, self.indexes.dtype.str)
+
+    def to_surface(self):
+        height, width = self.indexes.shape
+        surface = cairo.ImageSurface(self.format, width, height)
+
+        if self.palette is not None:
+            colors = self.palette[self.indexes]
+        else:
+            colors = self.indexes
+
+        surface_pixels(surface)[:] = colors.view(numpy.uint8).reshape(height, width, 4)
+        surface.mark_dirty()
+
+        return surface
+
+
+def _write_aligned(file, array):
+    offset = file.tell()
+    padding = -offset % ALIGNMENT
+    file.write(b'\0' * padding)
+    file.write(numpy.ascontiguousarray(array).tobytes())
+
+    return offset + padding
+
+
+class PaletteSource:
+    '''Frame source keeping every screenshot in memory.
+
+    Game screenshots have few colors, so a screenshot is stored as 8 bit
+    palette indexes, about a quarter of its decoded size, and identical
+    screenshots are stored once. When opened, every screenshot of the
+    wrapped source is decoded once, using a thread per CPU, and its
+    palette and indexes are written to a temporary file. Loading a
+    screenshot expands them back to a new surface.
+
+    Every process maps the same file, so worker processes share the one
+    copy in the OS cache. Until the source is opened, as when only its
+    listing is read, screenshots are loaded from the wrapped source.
+    '''
+    def __init__(self, source, log_func=print):
+        if not numpy:
+            raise ValueError('NumPy is required for paletted screenshots')
+
+        self.source = source
+        self.log_func = log_func
+        self.nbytes = 0
+        self._entries = None
+        self._filename = None
+        self._temp_dir = None
+        self._lock = threading.Lock()
+        self._map = None
+
+    def __getstate__(self):
+        return {
+            'source': self.source,
+            'log_func': None,
+            'nbytes': self.nbytes,
+            '_entries': self._entries,
+            '_filename': self._filename,
+        }
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._temp_dir = None
+        self._lock = threading.Lock()
+        self._map = None
+
+    def __getattr__(self, name):
+        if name.startswith('_') or name in ('source', 'log_func', 'nbytes'):
+            raise AttributeError(name)
+
+        return getattr(self.source, name)
+
+    def __len__(self):
+        return len(self.source)
+
+    def open(self):
+        self.source.open()
+
+        with self._lock:
+            self._map = None
+
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self._filename = os.path.join(self._temp_dir.name, 'palette')
+        self._entries = self._pack(self._filename)
+
+    def open_listing(self):
+        '''Open the wrapped source without decoding the screenshots.'''
+        open_listing = getattr(self.source, 'open_listing', None)
+
+        if open_listing:
+            open_listing()
+        else:
+            self.source.open()
+
+    def _pack(self, filename):
+        count = len(self.source)
+        entries = []
+        unique_entries = {}
+        self.nbytes = 0
+
+        with open(filename, 'wb') as file, concurrent.futures.ThreadPoolExecutor() as executor:
+            frames = executor.map(self._convert, range(count))
+
+            for index, frame in enumerate(frames):
+                if frame is None:
+                    entries.append(None)
+                    continue
+
+                digest = frame.digest()
+                entry = unique_entries.get(digest)
+
+                if not entry:
+                    entry = unique_entries[digest] = frame.write(file)
+                    self.nbytes += frame.nbytes
+
+                entries.append(entry)
+
+                if index % 1000 == 0:
+                    self.log_func('Paletted {}/{}'.format(index, count))
+
+        return tuple(entries)
+
+    def _convert(self, index):
+        surface = self.source.load(index)
+
+        if surface is not None:
+            return PalettedFrame.from_surface(surface)
+
+    def _get_map(self):
+        with self._lock:
+            if self._map is None:
+                with open(self._filename, 'rb') as file:
+                    self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+            return self._map
+
+    def load(self, index):
+        if self._entries is None:
+            return self.source.load(index)
+
+        entry = self._entries[index]
+
+        if entry is None:
+            return None
+
+        return PalettedFrame.from_buffer(self._get_map(), entry).to_surface()
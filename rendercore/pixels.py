@@ -0,0 +1,55 @@
+'''Access to the pixel data of cairo surfaces'''
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def surface_bytes(surface):
+    '''Copy the pixels of an ARGB32 surface without the row padding.'''
+    surface.flush()
+    row_size = surface.get_width() * 4
+    stride = surface.get_stride()
+    data = surface.get_data()
+
+    if stride == row_size:
+        return bytes(data)
+
+    return b''.join(
+        data[row * stride:row * stride + row_size]
+        for row in range(surface.get_height())
+    )
+
+
+def surface_pixels(surface):
+    '''Return a (height, width, 4) uint8 BGRA view of an ARGB32 surface.'''
+    surface.flush()
+    width = surface.get_width()
+    height = surface.get_height()
+    data = numpy.frombuffer(surface.get_data(), dtype=numpy.uint8)
+    data = data.reshape(height, surface.get_stride())[:, :width * 4]
+
+    return data.reshape(height, width, 4)
+
+
+def bgra_to_yuv420p(pixels):
+    '''Convert opaque BGRA pixels to planar BT.601 limited range YUV 4:2:0.
+
+    This is the same conversion ffmpeg does by default.
+    '''
+    pixels = pixels.astype(numpy.float32)
+    blue, green, red = pixels[:, :, 0], pixels[:, :, 1], pixels[:, :, 2]
+
+    y = 16 + 0.256788 * red + 0.504129 * green + 0.097906 * blue
+    u = 128 - 0.148223 * red - 0.290993 * green + 0.439216 * blue
+    v = 128 + 0.439216 * red - 0.367788 * green - 0.071427 * blue
+
+    height, width = y.shape
+    u = u.reshape(height // 2, 2, width // 2, 2).mean(axis=(1, 3))
+    v = v.reshape(height // 2, 2, width // 2, 2).mean(axis=(1, 3))
+
+    return b''.join(
+        numpy.clip(numpy.rint(plane), 0, 255).astype(numpy.uint8).tobytes()
+        for plane in (y, u, v)
+    )
@@ -0,0 +1,218 @@
+'''Input screenshots packed into a memory-mapped file of raw pixels'''
+
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import threading
+
+import cairo
+
+MAGIC = b'RCPX'
+VERSION = 1
+HEADER = struct.Struct('<4sIIIII')
+INDEX_ENTRY = struct.Struct('<q20s')
+ALIGNMENT = 4096
+
+
+def fingerprint_digest(fingerprint):
+    return hashlib.sha1(fingerprint.encode()).digest()
+
+
+def pack_pixels(source, filename, log_func=print):
+    '''Decode every screenshot of a source into a pixel store file.
+
+    The screenshots must all have the same size. They are stored as
+    ARGB32 one after the other, so a frame is found by its slot number
+    alone. Screenshots that can't be loaded don't get a slot.
+    '''
+    source.open()
+    fingerprints = source.fingerprints()
+    count = len(fingerprints)
+    data_offset = _align(HEADER.size + INDEX_ENTRY.size * count)
+    temp_filename = '{}.tmp'.format(filename)
+    entries = []
+    size = None
+    num_slots = 0
+
+    with open(temp_filename, 'wb') as file:
+        file.seek(data_offset)
+
+        for index, fingerprint in enumerate(fingerprints):
+            surface = source.load(index)
+
+            if surface is None:
+                entries.append(INDEX_ENTRY.pack(-1, fingerprint_digest(fingerprint)))
+                continue
+
+            if size is None:
+                size = (surface.get_width(), surface.get_height())
+            elif size != (surface.get_width(), surface.get_height()):
+                raise ValueError('Screenshot {} is {}x{} instead of {}x{}'.format(
+                    index, surface.get_width(), surface.get_height(), *size))
+
+            file.write(_argb32_bytes(surface))
+            entries.append(INDEX_ENTRY.pack(num_slots, fingerprint_digest(fingerprint)))
+            num_slots += 1
+
+            if index % 1000 == 0:
+                log_func('Packed {}/{}'.format(index, count))
+
+        width, height = size or (0, 0)
+
+        file.seek(0)
+        file.write(HEADER.pack(MAGIC, VERSION, width, height,
+                               cairo.ImageSurface.format_stride_for_width(cairo.FORMAT_ARGB32, width),
+                               count))
+        file.write(b''.join(entries))
+
+    os.replace(temp_filename, filename)
+
+
+def _align(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def _argb32_bytes(surface):
+    if surface.get_format() != cairo.FORMAT_ARGB32:
+        converted = cairo.ImageSurface(cairo.FORMAT_ARGB32, surface.get_width(), surface.get_height())
+        context = cairo.Context(converted)
+        context.set_source_surface(surface, 0, 0)
+        context.paint()
+        surface = converted
+
+    surface.flush()
+
+    return bytes(surface.get_data())
+
+
+class PixelStore:
+    '''Read access to a pixel store file.
+
+    The file is mapped copy-on-write because cairo wants writable
+    memory, but the frames are never written to, so every process
+    rendering from the same file shares its pages in the OS cache.
+    Surfaces point straight into the mapping.
+    '''
+    def __init__(self, filename):
+        self._filename = filename
+        self._lock = threading.Lock()
+        self._map = None
+
+        with open(filename, 'rb') as file:
+            header = file.read(HEADER.size)
+            magic, version, self.width, self.height, self.stride, self.count = HEADER.unpack(header)
+
+            if magic != MAGIC or version != VERSION:
+                raise ValueError('{} is not a pixel store file'.format(filename))
+
+            index = file.read(INDEX_ENTRY.size * self.count)
+
+        self._slots = []
+        self._digests = []
+
+        for slot, digest in INDEX_ENTRY.iter_unpack(index):
+            self._slots.append(slot)
+            self._digests.append(digest)
+
+        self._data_offset = _align(HEADER.size + INDEX_ENTRY.size * self.count)
+        self._frame_size = self.stride * self.height
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        state['_map'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def digest(self, index):
+        return self._digests[index]
+
+    def surface(self, index):
+        slot = self._slots[index]
+
+        if slot < 0:
+            return None
+
+        with self._lock:
+            if not self._map:
+                with open(self._filename, 'rb') as file:
+                    self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY)
+
+        offset = self._data_offset + slot * self._frame_size
+
+        return cairo.ImageSurface.create_for_data(
+            memoryview(self._map)[offset:offset + self._frame_size],
+            cairo.FORMAT_ARGB32, self.width, self.height, self.stride)
+
+
+class PixelStoreSource:
+    '''Frame source reading screenshots from a pixel store.
+
+    Everything else comes from the wrapped source. Screenshots whose
+    fingerprint changed since the store was packed are loaded from the
+    wrapped source instead. A source with open_listing(), like an
+    archive, is only listed, and extracted only if a screenshot changed.
+    '''
+    def __init__(self, source, filename):
+        self.source = source
+        self.store = PixelStore(filename)
+        self._stale = frozenset()
+
+    def __getattr__(self, name):
+        if name.startswith('_') or name in ('source', 'store'):
+            raise AttributeError(name)
+
+        return getattr(self.source, name)
+
+    def __len__(self):
+        return len(self.source)
+
+    def open(self):
+        self._open(extract=True)
+
+    def open_listing(self):
+        '''Open without extracting changed screenshots from an archive.'''
+        self._open(extract=False)
+
+    def _open(self, extract):
+        open_listing = getattr(self.source, 'open_listing', None)
+
+        if open_listing:
+            open_listing()
+        else:
+            self.source.open()
+
+        fingerprints = self.source.fingerprints()
+
+        if len(fingerprints) != self.store.count:
+            raise ValueError('Pixel store has {} screenshots instead of {}. Pack it again.'.format(
+                self.store.count, len(fingerprints)))
+
+        self._stale = frozenset(
+            index for index, fingerprint in enumerate(fingerprints)
+            if fingerprint_digest(fingerprint) != self.store.digest(index)
+        )
+
+        if self._stale:
+            logging.warning('%d screenshots changed since the pixel store was packed', len(self._stale))
+
+            if open_listing and extract:
+                self.source.extract()
+
+    def is_available(self, index):
+        if index in self._stale:
+            is_available = getattr(self.source, 'is_available', None)
+            return not is_available or is_available(index)
+
+        return True
+
+    def load(self, index):
+        if index in self._stale:
+            return self.source.load(index)
+
+        return self.store.surface(index)
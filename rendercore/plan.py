@@ -0,0 +1,133 @@
+'''Estimating what rendering a plan of jobs will take'''
+
+import collections
+import time
+
+from rendercore.cache import DEFAULT_MAX_SIZE
+from rendercore.palette import PaletteSource
+from rendercore.timeline import COMPOSITE_CACHE_SIZE, apply_fade
+
+# Number of inputs decoded and jobs rendered to time them
+DRY_RUN_SAMPLES = 5
+
+# Arrays the crossfade works on per thread, in bytes per screenshot byte:
+# a float32 result, or the int64 running sums on both sides
+CROSSFADE_WORK_FACTORS = {'cairo': 1, 'over': 4, 'linear': 32}
+
+PlanEstimate = collections.namedtuple('PlanEstimate', [
+    'output_frames', 'jobs', 'decodes', 'decode_seconds', 'compose_seconds',
+    'cpu_seconds', 'wall_seconds', 'memory_bytes'
+])
+'''What rendering a plan costs.
+
+decode_seconds and compose_seconds are the measured averages per input
+and per job, or None if no samples were available yet. memory_bytes is
+what the caches, the crossfade, paletted screenshots and the frames in
+flight hold at most, not counting the rest of the source.
+'''
+
+
+def _spread(items, count):
+    '''Pick up to count items evenly spaced over items.'''
+    if len(items) <= count:
+        return list(items)
+
+    return [items[i * (len(items) - 1) // (count - 1)] for i in range(count)]
+
+
+def estimate_plan(renderer, jobs, scheduler, samples=DRY_RUN_SAMPLES):
+    '''Count the work in the planned jobs and time a few of them.
+
+    Only inputs the source has ready are sampled, so the estimate doesn't
+    wait for an archive to be extracted.
+    '''
+    source = renderer.source
+    num_inputs = len(source)
+    inputs = set()
+
+    for job in jobs:
+        inputs.update(renderer.crossfade_window(job.input_index))
+
+    is_available = getattr(source, 'is_available', None) or (lambda index: True)
+    decode_times = []
+
+    for index in _spread([index for index in sorted(inputs) if is_available(index)], samples):
+        start_time = time.perf_counter()
+        source.load(index)
+        decode_times.append(time.perf_counter() - start_time)
+
+    ready_jobs = [
+        job for job in jobs
+        if all(is_available(index) for index in renderer.crossfade_window(job.input_index))
+    ]
+    compose_times = []
+
+    for job in _spread(ready_jobs, samples):
+        # Decode its window first so only the drawing is timed
+        renderer.render(job)
+
+        start_time = time.perf_counter()
+        apply_fade(renderer.compose_frame(job.input_index, job.overlay_state, job.info_lines),
+                   job.alpha)
+        compose_times.append(time.perf_counter() - start_time)
+
+    decode_seconds = sum(decode_times) / len(decode_times) if decode_times else None
+    compose_seconds = sum(compose_times) / len(compose_times) if compose_times else None
+
+    if decode_seconds is None or compose_seconds is None:
+        cpu_seconds = None
+    else:
+        cpu_seconds = len(inputs) * decode_seconds + len(jobs) * compose_seconds
+
+    layout = renderer.layout
+    input_bytes = layout.frame_width * layout.frame_height * 4
+    frame_bytes = layout.width * layout.height * 4
+    num_caches = scheduler.workers if scheduler.processes else 1
+    memory_bytes = (
+        num_caches * min(len(inputs), DEFAULT_MAX_SIZE) * input_bytes +
+        num_caches * COMPOSITE_CACHE_SIZE * frame_bytes +
+        scheduler.workers * CROSSFADE_WORK_FACTORS[renderer.crossfade_mode] * input_bytes +
+        scheduler.max_in_flight * frame_bytes
+    )
+
+    if isinstance(source, PaletteSource):
+        # One byte per pixel for every screenshot, shared by the processes
+        memory_bytes += num_inputs * input_bytes // 4
+
+    return PlanEstimate(
+        output_frames=sum(len(job.render_indexes) for job in jobs),
+        jobs=len(jobs),
+        decodes=num_inputs if isinstance(source, PaletteSource) else len(inputs),
+        decode_seconds=decode_seconds,
+        compose_seconds=compose_seconds,
+        cpu_seconds=cpu_seconds,
+        wall_seconds=cpu_seconds / scheduler.workers if cpu_seconds is not None else None,
+        memory_bytes=memory_bytes,
+    )
+
+
+def _format_ms(seconds):
+    if seconds is None:
+        return 'not timed'
+
+    return '{:.1f} ms each'.format(seconds * 1000)
+
+
+def format_estimate(estimate):
+    lines = [
+        'Output frames: {}'.format(estimate.output_frames),
+        'Composites to render: {}'.format(estimate.jobs),
+        'Screenshots to decode: {}'.format(estimate.decodes),
+        'Decode: {}, compose: {}'.format(
+            _format_ms(estimate.decode_seconds), _format_ms(estimate.compose_seconds)),
+    ]
+
+    if estimate.cpu_seconds is None:
+        lines.append('Estimated CPU time: unknown until the screenshots are available')
+    else:
+        lines.append('Estimated CPU time: {:.0f} s, about {:.0f} s with all workers'.format(
+            estimate.cpu_seconds, estimate.wall_seconds))
+
+    lines.append('Estimated peak memory: {:.0f} MiB'.format(estimate.memory_bytes / 1024 / 1024))
+
+    return '\n'.join(lines)
@@ -0,0 +1,266 @@
+'''Timing the stages of rendering each frame'''
+
+import contextlib
+import json
+import math
+import os
+import threading
+import time
+
+# How often progress is logged while profiling
+PROFILE_REPORT_INTERVAL = 30
+
+# Histogram buckets are powers of two of microseconds
+NUM_BUCKETS = 32
+
+STAGES = ('decode', 'crossfade', 'overlay', 'text', 'paint', 'fade', 'encode', 'write')
+
+
+class StageStats:
+    '''Count, total and a log scale histogram of the durations of a stage.'''
+    __slots__ = ('count', 'total', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.buckets = [0] * NUM_BUCKETS
+
+    def add(self, duration):
+        self.count += 1
+        self.total += duration
+        microseconds = max(1, int(duration * 1000000))
+        self.buckets[min(NUM_BUCKETS - 1, microseconds.bit_length() - 1)] += 1
+
+    def percentile(self, fraction):
+        '''Return the upper end in seconds of the bucket at the fraction.'''
+        target = fraction * self.count
+        seen = 0
+
+        for bucket, count in enumerate(self.buckets):
+            seen += count
+
+            if count and seen >= target:
+                return (2 ** (bucket + 1)) / 1000000
+
+        return 0.0
+
+
+class NullProfiler:
+    '''Profiler that doesn't record anything.'''
+    enabled = False
+
+    @contextlib.contextmanager
+    def span(self, stage, **args):
+        yield
+
+    def drain(self):
+        return []
+
+    def merge(self, spans):
+        pass
+
+
+NULL_PROFILER = NullProfiler()
+
+
+class Profiler:
+    '''Records how long each stage of each frame takes.
+
+    Stages are timed with span(). In worker processes the profiler only
+    collects spans, which the scheduler passes back to the main process
+    with drain() and merge(). The main process keeps the statistics,
+    logs progress with the frame rate and the time left, and optionally
+    writes every span to a Chrome trace event file (open it in
+    chrome://tracing or Perfetto) to see what each worker was doing.
+
+    Spans can nest: decoding the neighbors of a frame for the first time
+    is part of its crossfade. PNG output is encoded while it is written,
+    so it shows up as write.
+    '''
+    enabled = True
+
+    def __init__(self, trace_filename=None, log_func=print,
+                 report_interval=PROFILE_REPORT_INTERVAL):
+        self.trace_filename = trace_filename
+        self.log_func = log_func
+        self.report_interval = report_interval
+        self._setup()
+
+    def _setup(self):
+        self._lock = threading.Lock()
+        self._spans = []
+        self._stats = {}
+        self._trace_file = None
+        self._num_trace_events = 0
+        self._start_time = None
+        self._last_report_time = None
+        self._total_frames = 0
+        self._done_frames = 0
+
+    def __getstate__(self):
+        # Worker processes only collect spans
+        return {'trace_filename': None, 'log_func': None, 'report_interval': None}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._setup()
+
+    @contextlib.contextmanager
+    def span(self, stage, **args):
+        start_time = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            end_time = time.perf_counter()
+            span = (stage, start_time, end_time - start_time, os.getpid(),
+                    threading.get_ident(), args)
+
+            with self._lock:
+                self._spans.append(span)
+
+    def drain(self):
+        '''Remove and return the spans recorded so far.'''
+        with self._lock:
+            spans = self._spans
+            self._spans = []
+
+        return spans
+
+    def start(self, total_frames):
+        self._start_time = self._last_report_time = time.perf_counter()
+        self._total_frames = total_frames
+
+        if self.trace_filename:
+            self._trace_file = open(self.trace_filename, 'w')
+            self._trace_file.write('[\n')
+
+    def merge(self, spans):
+        '''Add spans to the statistics and the trace.'''
+        with self._lock:
+            for stage, start_time, duration, pid, thread_id, args in spans:
+                stats = self._stats.get(stage)
+
+                if not stats:
+                    stats = self._stats[stage] = StageStats()
+
+                stats.add(duration)
+
+                if self._trace_file:
+                    # Clocks of worker processes share the same base on
+                    # the platforms perf_counter is monotonic system wide
+                    event = {
+                        'name': stage, 'ph': 'X', 'pid': pid, 'tid': thread_id,
+                        'ts': round((start_time - self._start_time) * 1000000, 1),
+                        'dur': round(duration * 1000000, 1),
+                    }
+
+                    if args:
+                        event['args'] = args
+
+                    if self._num_trace_events:
+                        self._trace_file.write(',\n')
+
+                    self._trace_file.write(json.dumps(event))
+                    self._num_trace_events += 1
+
+    def count(self, stage):
+        '''Return the number of spans of a stage merged so far.'''
+        with self._lock:
+            stats = self._stats.get(stage)
+
+            return stats.count if stats else 0
+
+    def frames_done(self, count):
+        '''Count output frames as written and log progress now and then.'''
+        self.merge(self.drain())
+
+        with self._lock:
+            self._done_frames += count
+            now = time.perf_counter()
+
+            if now - self._last_report_time < self.report_interval:
+                return
+
+            self._last_report_time = now
+            line = self._progress_line(now)
+
+        self.log_func(line)
+
+    def _progress_line(self, now):
+        elapsed = now - self._start_time
+        rate = self._done_frames / elapsed if elapsed else 0
+        remaining = self._total_frames - self._done_frames
+
+        if rate:
+            eta = format_seconds(remaining / rate)
+        else:
+            eta = 'unknown'
+
+        return '{}/{} frames, {:.2f} frames/s, {} elapsed, ETA {}'.format(
+            self._done_frames, self._total_frames, rate, format_seconds(elapsed), eta)
+
+    def finish(self):
+        '''Log the statistics of each stage and close the trace.'''
+        self.merge(self.drain())
+
+        with self._lock:
+            if self._trace_file:
+                self._trace_file.write('\n]\n')
+                self._trace_file.close()
+                self._trace_file = None
+
+            lines = [self._progress_line(time.perf_counter())]
+            lines.append('{:10} {:>8} {:>10} {:>9} {:>9} {:>9} {:>9}'.format(
+                'stage', 'count', 'total s', 'mean ms', 'p50 ms', 'p90 ms', 'p99 ms'))
+
+            stages = sorted(self._stats, key=lambda stage: (
+                STAGES.index(stage) if stage in STAGES else len(STAGES), stage))
+
+            for stage in stages:
+                stats = self._stats[stage]
+                lines.append('{:10} {:8} {:10.1f} {:9.2f} {:9.2f} {:9.2f} {:9.2f}'.format(
+                    stage, stats.count, stats.total, stats.total / stats.count * 1000,
+                    stats.percentile(0.5) * 1000, stats.percentile(0.9) * 1000,
+                    stats.percentile(0.99) * 1000))
+
+            for stage in stages:
+                lines.extend(format_histogram(stage, self._stats[stage]))
+
+        for line in lines:
+            self.log_func(line)
+
+
+def format_histogram(stage, stats, width=40):
+    '''Return lines of a text bar chart of the durations of a stage.'''
+    used = [bucket for bucket, count in enumerate(stats.buckets) if count]
+
+    if not used:
+        return []
+
+    largest = max(stats.buckets)
+    lines = ['{} histogram:'.format(stage)]
+
+    for bucket in range(used[0], used[-1] + 1):
+        count = stats.buckets[bucket]
+        lines.append('  < {:>9} {:8} {}'.format(
+            format_microseconds(2 ** (bucket + 1)), count,
+            '#' * math.ceil(count / largest * width)))
+
+    return lines
+
+
+def format_microseconds(microseconds):
+    if microseconds < 1000:
+        return '{} us'.format(microseconds)
+    elif microseconds < 1000000:
+        return '{:g} ms'.format(microseconds / 1000)
+    else:
+        return '{:g} s'.format(microseconds / 1000000)
+
+
+def format_seconds(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+
+    return '{}:{:02}:{:02}'.format(hours, minutes, seconds)
@@ -0,0 +1,302 @@
+'''Composing output frames from a frame source'''
+
+import argparse
+import hashlib
+
+import cairo
+
+from rendercore.blend import Crossfade, DEFAULT_MODE
+from rendercore.cache import FrameCache
+from rendercore.overlay import OverlayLayer
+from rendercore.palette import PaletteSource
+from rendercore.pixels import surface_bytes
+from rendercore.pixelstore import PixelStoreSource
+from rendercore.plan import estimate_plan, format_estimate
+from rendercore.profile import NULL_PROFILER
+from rendercore.scheduler import Scheduler
+from rendercore.text import draw_info_line, format_duration
+from rendercore.timeline import COMPOSITE_CACHE_SIZE, apply_fade, build_timeline, plan_jobs, \
+    shard_jobs, shard_range
+from rendercore.upscale import NearestUpscaler
+
+FPS = 12
+CROSSFADE_RANGE = (-24, 4)
+
+
+def parse_shard(text):
+    '''Parse "i/N" into a zero based shard index and the number of shards.'''
+    try:
+        shard_number, num_shards = (int(part) for part in text.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError('Shard should look like 1/4')
+
+    if not 1 <= shard_number <= num_shards:
+        raise argparse.ArgumentTypeError('Shard should be between 1/{0} and {0}/{0}'.format(num_shards))
+
+    return shard_number - 1, num_shards
+
+
+def add_render_arguments(arg_parser):
+    arg_parser.add_argument(
+        '--preview-scale', type=float, default=1,
+        help='Render frames at this fraction of the full size')
+    arg_parser.add_argument(
+        '--preview-stride', type=int, default=1,
+        help='Only render every Nth input frame')
+    arg_parser.add_argument(
+        '--shard', type=parse_shard,
+        help='Only render part i of N (such as 1/4) of the output frames')
+    arg_parser.add_argument(
+        '--dry-run', action='store_true',
+        help='Plan the render and print an estimate of its cost without '
+             'writing any frames')
+    arg_parser.add_argument(
+        '--pack-pixels', action='store_true',
+        help='Instead of rendering, decode the screenshots into a pixel store '
+             'file at the output path')
+    arg_parser.add_argument(
+        '--pixel-store', metavar='FILE',
+        help='Read the screenshots from a pixel store file made with --pack-pixels')
+    arg_parser.add_argument(
+        '--palette', action='store_true',
+        help='Decode all screenshots up front and keep them in memory as '
+             'palette indexes')
+
+
+def wrap_source(source, args):
+    '''Apply the source options of add_render_arguments().'''
+    if args.pixel_store:
+        source = PixelStoreSource(source, args.pixel_store)
+
+    if args.palette:
+        source = PaletteSource(source)
+
+    return source
+
+
+class FrameRenderer:
+    '''Draws the input frames of a source onto a layout.
+
+    Each output frame has a static overlay, lines of info text in the
+    sidebar, the crossfaded neighbors in the sidebar and the screenshot.
+    Videos customize it by overriding:
+
+    * draw_overlay(context, *state): the parts that don't change between
+      frames, such as the title. overlay_state(index) returns the state
+      it is drawn with.
+    * info_lines(index): (symbol, text) pairs. By default the date, the
+      time since the first frame and the frame counter.
+    * draw_missing(context, index): called in the screenshot's
+      coordinates when the screenshot couldn't be loaded.
+
+    Output frames are identified by a digest of the inputs in their
+    crossfade window, their text and the render parameters. Increase
+    version when the drawing changes in a way the digest doesn't cover.
+
+    plan() works out the overlay state, the text and the digest of every
+    job up front in the main process, so the workers only draw.
+    '''
+    fps = FPS
+    crossfade_range = CROSSFADE_RANGE
+    version = 4
+    profiler = NULL_PROFILER
+
+    def __init__(self, source, layout, crossfade_mode=DEFAULT_MODE, stride=1, shard=None):
+        self.source = source
+        self.layout = layout
+        self.crossfade_mode = crossfade_mode
+        self.stride = stride
+        self.shard = shard
+
+        self.setup_caches()
+
+    def __getstate__(self):
+        # Only what worker processes need to render frames
+        return {
+            key: value for key, value in self.__dict__.items()
+            if key not in ('frame_cache', 'crossfade', 'overlay', 'composite_cache', 'upscaler')
+        }
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.setup_caches()
+
+    def setup_caches(self):
+        self.frame_cache = FrameCache(self.load_input)
+        self.crossfade = Crossfade(self.frame_cache, len(self.source), self.crossfade_range,
+                                   mode=self.crossfade_mode, stride=self.stride)
+        self.overlay = OverlayLayer(self.layout.width, self.layout.height, self.draw_overlay)
+        self.composite_cache = FrameCache(self.compose_frame, max_size=COMPOSITE_CACHE_SIZE)
+        self.upscaler = NearestUpscaler()
+
+    def open(self, listing_only=False):
+        '''Open the source and return the jobs rendering the video.
+
+        With a shard, the jobs are still planned for the whole video so
+        the fades and the text are the same as in a single render. Only
+        the inputs around the shard's frames are loaded.
+
+        With listing_only, a source with open_listing(), like an archive,
+        is only listed and its screenshots aren't extracted.
+        '''
+        open_listing = listing_only and getattr(self.source, 'open_listing', None)
+
+        if open_listing:
+            open_listing()
+        else:
+            self.source.open()
+
+        self.setup_caches()
+
+        timeline = self.timeline()
+        jobs = plan_jobs(timeline, self.fps)
+
+        if self.shard:
+            jobs = shard_jobs(jobs, *shard_range(len(timeline), *self.shard))
+
+        return jobs
+
+    def timeline(self):
+        return build_timeline(len(self.source), self.fps, self.stride)
+
+    def run(self, sink, scheduler=None, skip_exists=False):
+        '''Render the video into a sink.
+
+        With skip_exists, only frames that are missing or whose digest
+        changed are rendered.
+        '''
+        scheduler = scheduler or Scheduler()
+        jobs = self.plan()
+
+        if self.shard:
+            sink.start_at(shard_range(len(self.timeline()), *self.shard)[0])
+
+        scheduler.run(self, jobs, sink, skip_exists=skip_exists)
+
+    def dry_run(self, scheduler=None, log_func=print):
+        '''Plan the render and log what it would take.'''
+        scheduler = scheduler or Scheduler()
+        estimate = estimate_plan(self, self.plan(listing_only=True), scheduler)
+
+        for line in format_estimate(estimate).splitlines():
+            log_func(line)
+
+        return estimate
+
+    def plan(self, listing_only=False):
+        '''Open the source and return the jobs with everything filled in.'''
+        jobs = self.open(listing_only)
+        fingerprints = self.source.fingerprints()
+        planned_jobs = []
+
+        for job in jobs:
+            job = job._replace(overlay_state=self.overlay_state(job.input_index),
+                               info_lines=self.info_lines(job.input_index))
+            planned_jobs.append(job._replace(digest=self.job_digest(job, fingerprints)))
+
+        return planned_jobs
+
+    def crossfade_window(self, index):
+        '''Return the input indexes the crossfade of an input is blended from.'''
+        return range(max(0, index + self.crossfade_range[0] * self.stride),
+                     min(len(self.source), index + self.crossfade_range[1] * self.stride + 1),
+                     self.stride)
+
+    def job_digest(self, job, fingerprints):
+        index = job.input_index
+
+        dependencies = (
+            self.version, self.layout, self.crossfade_mode, self.crossfade_range,
+            self.fps, job.alpha, job.overlay_state, job.info_lines,
+            index, tuple(fingerprints[sub_index] for sub_index in self.crossfade_window(index)),
+        )
+
+        return hashlib.sha1(repr(dependencies).encode()).hexdigest()
+
+    def frames(self):
+        '''Render the video in order in this thread.
+
+        Yields the render index and the frame as bytes of BGRA pixels.
+        '''
+        for job in self.open():
+            data = surface_bytes(self.render(job))
+
+            for render_index in job.render_indexes:
+                yield render_index, data
+
+    def draw_overlay(self, context):
+        pass
+
+    def overlay_state(self, index):
+        return ()
+
+    def info_lines(self, index):
+        date = self.source.date(index)
+
+        return [
+            ('📆', date.strftime(' %Y-%m-%d %H:%M:%S')),
+            ('⏱', format_duration(date - self.source.date(0))),
+            ('📸', ' {:05}'.format(index + 1)),
+        ]
+
+    def draw_missing(self, context, index):
+        pass
+
+    def load_input(self, index):
+        with self.profiler.span('decode', input=index):
+            return self.source.load(index)
+
+    def render(self, job):
+        composite = self.composite_cache.get(job.input_index, job.overlay_state, job.info_lines)
+
+        with self.profiler.span('fade', input=job.input_index):
+            return apply_fade(composite, job.alpha)
+
+    def compose_frame(self, index, overlay_state=None, info_lines=None):
+        layout = self.layout
+        surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, layout.width, layout.height)
+        context = cairo.Context(surface)
+
+        if overlay_state is None:
+            overlay_state = self.overlay_state(index)
+
+        if info_lines is None:
+            info_lines = self.info_lines(index)
+
+        profiler = self.profiler
+
+        with profiler.span('overlay', input=index):
+            self.overlay.paint(context, *overlay_state)
+
+        with profiler.span('text', input=index):
+            for line, (symbol, text) in enumerate(info_lines):
+                draw_info_line(context, layout, line, symbol, text)
+
+        # Draw the cross faded image
+        with profiler.span('crossfade', input=index):
+            self.crossfade.paint(context, index, layout.sidebar_x, layout.sidebar_y,
+                                 layout.sidebar_scale)
+
+        # Draw the main image
+        input_surface = self.frame_cache.get(index)
+
+        with profiler.span('paint', input=index):
+            if input_surface is None or not self.upscaler.paint(
+                    context, surface, input_surface, layout.screenshot_x, layout.screenshot_y,
+                    layout.screenshot_scale):
+                context.save()
+                context.translate(layout.screenshot_x, layout.screenshot_y)
+                context.scale(layout.screenshot_scale, layout.screenshot_scale)
+
+                if input_surface is not None:
+                    context.set_source_surface(input_surface, 0, 0)
+                    context.get_source().set_filter(cairo.FILTER_NEAREST)
+                    context.paint()
+                else:
+                    self.draw_missing(context, index)
+
+                context.restore()
+
+        surface.flush()
+
+        return surface
@@ -0,0 +1,430 @@
+'''Running render jobs on a pool of workers'''
+
+import concurrent.futures
+import errno
+import itertools
+import multiprocessing
+import os
+import pickle
+import queue
+import threading
+
+from rendercore.profile import NULL_PROFILER, Profiler
+from rendercore.timeline import shard_range
+
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:
+    shared_memory = None
+
+# Number of consecutive jobs given to a worker process at a time when
+# the sink needs the frames in order. Each worker keeps its own decoded
+# frame window, which stays warm within a chunk.
+DEFAULT_CHUNK_SIZE = 32
+
+# Where shared memory segments live on Linux
+SHARED_MEMORY_DIR = '/dev/shm'
+
+
+def chunked(iterable, n):
+    '''Split into lists of up to n items.'''
+    iterator = iter(iterable)
+
+    while True:
+        chunk = list(itertools.islice(iterator, n))
+
+        if not chunk:
+            break
+
+        yield chunk
+
+
+def split_lanes(jobs, num_lanes):
+    '''Split a list into up to num_lanes contiguous parts of about equal size.'''
+    lanes = (jobs[slice(*shard_range(len(jobs), lane, num_lanes))] for lane in range(num_lanes))
+
+    return [lane for lane in lanes if lane]
+
+
+def add_scheduler_arguments(arg_parser):
+    arg_parser.add_argument(
+        '--workers', type=int, default=multiprocessing.cpu_count(),
+        help='Number of frames to render in parallel')
+    arg_parser.add_argument(
+        '--writers', type=int,
+        help='Number of threads writing frames to the output '
+             '(default: half the workers)')
+    arg_parser.add_argument(
+        '--max-in-flight', type=int,
+        help='Maximum number of frames being rendered or waiting to be '
+             'written (default: four per worker thread, or a chunk per '
+             'worker process)')
+    arg_parser.add_argument(
+        '--processes', action='store_true',
+        help='Render in worker processes instead of threads')
+    arg_parser.add_argument(
+        '--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+        help='Consecutive frames given to a worker process at a time with --video')
+    arg_parser.add_argument(
+        '--profile', action='store_true',
+        help='Time each stage of rendering and log the frame rate, the time '
+             'left and a summary at the end')
+    arg_parser.add_argument(
+        '--profile-trace', metavar='FILE',
+        help='Also write the timings to a Chrome trace event JSON file '
+             '(implies --profile)')
+
+
+def create_scheduler(args, log_func=print):
+    if args.profile or args.profile_trace:
+        profiler = Profiler(trace_filename=args.profile_trace, log_func=log_func)
+    else:
+        profiler = None
+
+    return Scheduler(
+        workers=args.workers, writers=args.writers, max_in_flight=args.max_in_flight,
+        processes=args.processes, chunk_size=args.chunk_size, log_func=log_func,
+        profiler=profiler
+    )
+
+
+class Scheduler:
+    '''Renders jobs with renderer.render(job) and writes them to a sink.
+
+    Jobs are fed continuously to the workers, up to a limit of frames in
+    flight. A frame stops counting once the sink reports it as written,
+    so a sink that falls behind slows down rendering.
+
+    In thread mode, rendering and writing are separate pools so encoding
+    and disk writes don't hold up rendering. With processes, the
+    renderer is pickled into each worker process. Unless the sink needs
+    the frames in order, each worker renders one contiguous part of the
+    jobs, so its decoded frame window stays warm for the whole run.
+    Otherwise the workers are given chunks of consecutive jobs. A whole
+    chunk is in flight while it is being rendered, so by default every
+    worker can have one.
+
+    With a profiler, the renderer is given the profiler so the stages of
+    each frame are timed, and the profiler's summary is logged at the end.
+    '''
+    def __init__(self, workers=None, writers=None, max_in_flight=None,
+                 processes=False, chunk_size=DEFAULT_CHUNK_SIZE, log_func=print,
+                 profiler=None):
+        self.workers = workers or multiprocessing.cpu_count()
+        self.writers = writers or max(1, self.workers // 2)
+        self.max_in_flight = max_in_flight or \
+            self.workers * (chunk_size if processes else 4)
+        self.processes = processes
+        self.chunk_size = chunk_size
+        self.log_func = log_func
+        self.profiler = profiler or NULL_PROFILER
+
+    def run(self, renderer, jobs, sink, skip_exists=False):
+        if skip_exists:
+            jobs = (job for job in jobs if not sink.exists(job))
+
+        renderer.profiler = self.profiler
+
+        if self.profiler.enabled:
+            jobs = list(jobs)
+            self.profiler.start(sum(len(job.render_indexes) for job in jobs))
+
+        try:
+            if self.processes:
+                self._run_processes(renderer, jobs, sink)
+            else:
+                _ThreadPipeline(self, renderer, sink).run(jobs)
+        finally:
+            if self.profiler.enabled:
+                self.profiler.finish()
+
+    def log_job(self, sink, job):
+        for render_index in job.render_indexes:
+            self.log_func(sink.frame_name(render_index))
+
+        if self.profiler.enabled:
+            self.profiler.frames_done(len(job.render_indexes))
+
+    def _run_processes(self, renderer, jobs, sink):
+        if not sink.shareable and not shared_memory:
+            raise ValueError('Python 3.8 or newer is required to pass frames from worker processes')
+
+        if not sink.ordered:
+            # Nothing is held waiting for earlier frames, so nothing
+            # needs limiting
+            lanes = split_lanes(list(jobs), self.workers)
+            _ProcessPipeline(self, renderer, sink).run(lanes, max_in_flight=None)
+            return
+
+        # Every frame of a chunk is in flight from when the chunk is
+        # given out, so with a lower --max-in-flight chunks are made small
+        # enough for every worker to have one
+        chunk_size = min(self.chunk_size, max(1, self.max_in_flight // self.workers))
+
+        if chunk_size < self.chunk_size:
+            self.log_func('Using chunks of {} frames to stay within {} frames in flight'.format(
+                chunk_size, self.max_in_flight))
+
+        _ProcessPipeline(self, renderer, sink).run(chunked(jobs, chunk_size), self.max_in_flight)
+
+
+class _ThreadPipeline:
+    '''Render threads feeding writer threads.'''
+    def __init__(self, scheduler, renderer, sink):
+        self._scheduler = scheduler
+        self._renderer = renderer
+        self._sink = sink
+        self._condition = threading.Condition()
+        self._in_flight = 0
+        self._error = None
+        self._write_executor = None
+
+    def run(self, jobs):
+        scheduler = self._scheduler
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=scheduler.writers) as write_executor:
+            self._write_executor = write_executor
+
+            with concurrent.futures.ThreadPoolExecutor(max_workers=scheduler.workers) as render_executor:
+                for job in jobs:
+                    with self._condition:
+                        self._condition.wait_for(
+                            lambda: self._error or self._in_flight < scheduler.max_in_flight)
+
+                        if self._error:
+                            break
+
+                        self._in_flight += 1
+
+                    render_executor.submit(self._render, job)
+
+                with self._condition:
+                    self._condition.wait_for(lambda: self._error or not self._in_flight)
+
+        if self._error:
+            raise self._error
+
+    def _fail(self, error):
+        with self._condition:
+            self._error = self._error or error
+            self._condition.notify_all()
+
+    def _render(self, job):
+        if self._error:
+            return
+
+        try:
+            surface = self._renderer.render(job)
+            self._write_executor.submit(self._write, job, surface)
+        except Exception as error:
+            self._fail(error)
+
+    def _write(self, job, surface):
+        if self._error:
+            return
+
+        profiler = self._scheduler.profiler
+        frame = job.render_indexes[0]
+
+        try:
+            if self._sink.shareable:
+                with profiler.span('write', frame=frame):
+                    num_written = self._sink.write(job, surface)
+            else:
+                with profiler.span('encode', frame=frame):
+                    data = self._sink.encoder(surface)
+
+                with profiler.span('write', frame=frame):
+                    num_written = self._sink.write_data(job, data)
+        except Exception as error:
+            self._fail(error)
+            return
+
+        self._scheduler.log_job(self._sink, job)
+
+        with self._condition:
+            self._in_flight -= num_written
+            self._condition.notify_all()
+
+
+class _ProcessPipeline:
+    '''Worker processes rendering chunks and streaming back each frame.
+
+    Each chunk is rendered by one worker in order. With a limit of frames
+    in flight, a chunk is only given out once it fits.
+
+    Each worker puts every job on a queue as soon as it is done, with
+    the encoded frame in a shared memory segment unless the worker wrote
+    it to the sink itself. The queue holds one frame per worker, so at
+    most about two frames per worker are in shared memory at once.
+    '''
+    def __init__(self, scheduler, renderer, sink):
+        self._scheduler = scheduler
+        self._renderer = renderer
+        self._sink = sink
+        self._queue = None
+        self._futures = set()
+        self._in_flight = 0
+
+    def run(self, chunks, max_in_flight):
+        scheduler = self._scheduler
+        sink = self._sink
+        self._queue = multiprocessing.Queue(scheduler.workers)
+
+        if sink.shareable:
+            init_args = (pickle.dumps(self._renderer), sink, None, self._queue)
+        else:
+            init_args = (pickle.dumps(self._renderer), None, sink.encoder, self._queue)
+
+            # Workers need to share the parent's tracker of shared memory.
+            # Otherwise each one starts its own, which warns about every
+            # frame the parent unlinked as leaked when the worker exits.
+            resource_tracker.ensure_running()
+
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=scheduler.workers, initializer=_init_process,
+                initargs=init_args) as executor:
+            try:
+                for chunk in chunks:
+                    while max_in_flight and self._in_flight and \
+                            self._in_flight + len(chunk) > max_in_flight:
+                        self._receive()
+
+                    self._futures.add(executor.submit(_render_chunk, chunk))
+                    self._in_flight += len(chunk)
+
+                while self._in_flight:
+                    self._receive()
+
+                for future in concurrent.futures.as_completed(self._futures):
+                    scheduler.profiler.merge(future.result())
+            except BaseException:
+                self._abort()
+                raise
+
+    def _receive(self):
+        try:
+            job, memory_name, size = self._queue.get(timeout=0.1)
+        except queue.Empty:
+            self._check_chunks()
+            return
+
+        if memory_name:
+            with self._scheduler.profiler.span('write', frame=job.render_indexes[0]):
+                num_written = self._sink.write_data(job, _receive_frame(memory_name, size))
+        else:
+            num_written = 1
+
+        self._scheduler.log_job(self._sink, job)
+        self._in_flight -= num_written
+
+    def _check_chunks(self):
+        # A chunk that failed stops sending its frames, so look for errors
+        # while waiting for them
+        for future in [future for future in self._futures if future.done()]:
+            self._futures.remove(future)
+            self._scheduler.profiler.merge(future.result())
+
+    def _abort(self):
+        # Workers may be waiting to put frames on the queue, so keep
+        # freeing their shared memory until they stop
+        for future in self._futures:
+            future.cancel()
+
+        while not all(future.done() for future in self._futures):
+            self._discard_queued(timeout=0.1)
+
+        self._discard_queued(timeout=0.1)
+
+    def _discard_queued(self, timeout):
+        while True:
+            try:
+                job, memory_name, size = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                return
+
+            if memory_name:
+                _unlink_frame(memory_name)
+
+
+_process_renderer = None
+_process_sink = None
+_process_encoder = None
+_process_queue = None
+
+
+def _init_process(pickled_renderer, sink, encoder, frame_queue):
+    global _process_renderer, _process_sink, _process_encoder, _process_queue
+
+    # Unpickled here instead of by the pool so every worker starts with
+    # its own caches, even when the pool forks the parent process
+    _process_renderer = pickle.loads(pickled_renderer)
+    _process_sink = sink
+    _process_encoder = encoder
+    _process_queue = frame_queue
+
+
+def _render_chunk(jobs):
+    # Frames are either written by the worker or passed back to the
+    # parent process in shared memory, one at a time
+    profiler = _process_renderer.profiler
+
+    for job in jobs:
+        surface = _process_renderer.render(job)
+        frame = job.render_indexes[0]
+
+        if _process_sink:
+            with profiler.span('write', frame=frame):
+                _process_sink.write(job, surface)
+
+            _process_queue.put((job, None, 0))
+        else:
+            with profiler.span('encode', frame=frame):
+                data = _process_encoder(surface)
+
+            _send_frame(job, data)
+
+    return profiler.drain()
+
+
+def _send_frame(job, data):
+    _check_shared_memory(len(data))
+    memory = shared_memory.SharedMemory(create=True, size=len(data))
+
+    try:
+        memory.buf[:len(data)] = data
+        memory.close()
+        _process_queue.put((job, memory.name, len(data)))
+    except BaseException:
+        memory.close()
+        memory.unlink()
+        raise
+
+
+def _check_shared_memory(size):
+    # Writing past the end of a full /dev/shm kills the process with
+    # SIGBUS instead of raising an error
+    try:
+        stat = os.statvfs(SHARED_MEMORY_DIR)
+    except OSError:
+        return
+
+    if stat.f_bavail * stat.f_frsize < size:
+        raise OSError(errno.ENOSPC, 'Not enough room in {} for a {} byte frame; use fewer '
+                                    '--workers or give it more space'.format(SHARED_MEMORY_DIR, size))
+
+
+def _receive_frame(memory_name, size):
+    memory = shared_memory.SharedMemory(name=memory_name)
+
+    try:
+        return bytes(memory.buf[:size])
+    finally:
+        memory.close()
+        memory.unlink()
+
+
+def _unlink_frame(memory_name):
+    memory = shared_memory.SharedMemory(name=memory_name)
+    memory.close()
+    memory.unlink()
@@ -0,0 +1,372 @@
+'''Writing rendered frames'''
+
+import functools
+import hashlib
+import os
+import shlex
+import shutil
+import subprocess
+import threading
+
+from rendercore.manifest import MANIFEST_FILENAME, Manifest
+from rendercore.pixels import bgra_to_yuv420p, numpy, surface_bytes, surface_pixels
+
+CHECKSUM_MODES = ('record', 'verify')
+
+# Number of differing frames listed when verifying checksums
+MAX_REPORTED_MISMATCHES = 10
+
+DEFAULT_FFMPEG_ARGS = '-c:v libvpx-vp9 -b:v 4000k -crf 33 -threads 8 -tile-columns 6 -pix_fmt yuv420p -f webm'
+
+
+def temp_filename(filename):
+    return '{}.{}.tmp'.format(filename, os.getpid())
+
+
+def link_or_copy(source, destination):
+    '''Hard link a file, or copy it if hard links aren't supported.
+
+    The destination is replaced atomically.
+    '''
+    temp_destination = temp_filename(destination)
+
+    if os.path.lexists(temp_destination):
+        os.remove(temp_destination)
+
+    try:
+        os.link(source, temp_destination)
+    except OSError:
+        shutil.copyfile(source, temp_destination)
+
+    os.replace(temp_destination, destination)
+
+
+def add_sink_arguments(arg_parser):
+    arg_parser.add_argument(
+        '--video', action='store_true',
+        help='Encode frames with ffmpeg into the output path as a video file '
+             'instead of writing PNGs into it as a directory')
+    arg_parser.add_argument(
+        '--ffmpeg-args', default=DEFAULT_FFMPEG_ARGS,
+        help='ffmpeg output options used with --video')
+    arg_parser.add_argument(
+        '--yuv420p', action='store_true',
+        help='Convert frames to YUV 4:2:0 before piping them to ffmpeg')
+    arg_parser.add_argument(
+        '--checksums', choices=CHECKSUM_MODES,
+        help='Instead of writing frames, record a checksum of each frame\'s '
+             'pixels into the output path, or verify them against it')
+    arg_parser.add_argument(
+        '--no-output', action='store_true',
+        help='Render the frames and throw them away')
+
+
+def create_sink(args, output, width, height, fps):
+    if sum(bool(option) for option in (args.video, args.checksums, args.no_output)) > 1:
+        raise ValueError('Only one of --video, --checksums and --no-output can be used')
+
+    if not args.video and not args.checksums and not args.no_output:
+        return PNGSink(output)
+
+    if getattr(args, 'skip_exists', False):
+        raise ValueError('--skip-exists can only be used when writing PNGs')
+
+    if args.checksums:
+        return ChecksumSink(output, verify=args.checksums == 'verify')
+    elif args.no_output:
+        return NullSink()
+
+    return FFmpegSink(output, width, height, fps, ffmpeg_args=shlex.split(args.ffmpeg_args),
+                      yuv420p=args.yuv420p)
+
+
+def frame_checksum(surface):
+    '''SHA-1 of the BGRA pixels of a frame.'''
+    return hashlib.sha1(surface_bytes(surface)).hexdigest().encode()
+
+
+def encode_raw_frame(surface, yuv420p=False):
+    if yuv420p:
+        return bgra_to_yuv420p(surface_pixels(surface))
+    else:
+        return surface_bytes(surface)
+
+
+class PNGSink:
+    '''Writes each output frame as a numbered PNG into a directory.
+
+    Files are written under a temporary name and renamed into place so
+    a crash doesn't leave a partial frame. The digest of each job is
+    recorded in a manifest in the directory. A frame only counts as
+    existing if its digest matches, so changed frames are rendered
+    again.
+
+    The sink can be shared with worker processes which write their
+    frames themselves.
+    '''
+    shareable = True
+    ordered = False
+
+    def __init__(self, output_dir):
+        self._output_dir = output_dir
+        self._manifest = Manifest(os.path.join(output_dir, MANIFEST_FILENAME))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def frame_name(self, render_index):
+        return os.path.join(self._output_dir, '{:05}.png'.format(render_index))
+
+    def start_at(self, render_index):
+        pass
+
+    def exists(self, job):
+        return all(
+            os.path.exists(self.frame_name(render_index)) and
+            (job.digest is None or self._manifest.get(render_index) == job.digest)
+            for render_index in job.render_indexes
+        )
+
+    def write(self, job, surface):
+        filenames = tuple(self.frame_name(render_index) for render_index in job.render_indexes)
+        temp_name = temp_filename(filenames[0])
+
+        surface.write_to_png(temp_name)
+        os.replace(temp_name, filenames[0])
+
+        for filename in filenames[1:]:
+            link_or_copy(filenames[0], filename)
+
+        if job.digest is not None:
+            self._manifest.record(job.render_indexes, job.digest)
+
+        return 1
+
+    def close(self):
+        self._manifest.close()
+
+
+class FFmpegSink:
+    '''Pipes raw frames into ffmpeg in render order.
+
+    Frames can be written from any thread in any order. Frames that
+    arrive before the ones preceding them are held until they can be
+    written.
+
+    Worker processes can't write to the pipe, so they convert frames
+    with the encoder function and pass the data back for write_data().
+
+    Writing returns the number of jobs that made it into the pipe, which
+    is zero while the frame is held.
+    '''
+    shareable = False
+    ordered = True
+
+    def __init__(self, filename, width, height, fps,
+                 ffmpeg_args=shlex.split(DEFAULT_FFMPEG_ARGS), yuv420p=False):
+        if yuv420p and not numpy:
+            raise ValueError('NumPy is required for YUV conversion')
+
+        if yuv420p and (width % 2 or height % 2):
+            raise ValueError('YUV 4:2:0 needs an even frame size')
+
+        self._filename = filename
+        self.encoder = functools.partial(encode_raw_frame, yuv420p=yuv420p)
+        self._lock = threading.Lock()
+        self._next_render_index = 0
+        self._pending = {}
+
+        self._process = subprocess.Popen(
+            [
+                'ffmpeg', '-y', '-v', 'warning',
+                '-f', 'rawvideo',
+                '-pix_fmt', 'yuv420p' if yuv420p else 'bgra',
+                '-s', '{}x{}'.format(width, height),
+                '-r', str(fps),
+                '-i', '-',
+                '-r', str(fps),
+            ] + list(ffmpeg_args) + [filename],
+            stdin=subprocess.PIPE
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type:
+            self._process.kill()
+            self._process.wait()
+        else:
+            self.close()
+
+    def frame_name(self, render_index):
+        return '{}:{:05}'.format(self._filename, render_index)
+
+    def start_at(self, render_index):
+        '''Begin the video at a render index, such as the start of a shard.'''
+        with self._lock:
+            self._next_render_index = render_index
+
+    def exists(self, job):
+        return False
+
+    def write(self, job, surface):
+        return self.write_data(job, self.encoder(surface))
+
+    def write_data(self, job, data):
+        with self._lock:
+            self._pending[job.render_indexes[0]] = (data, len(job.render_indexes))
+            num_written = 0
+
+            while self._next_render_index in self._pending:
+                data, count = self._pending.pop(self._next_render_index)
+
+                for _ in range(count):
+                    self._process.stdin.write(data)
+
+                self._next_render_index += count
+                num_written += 1
+
+            return num_written
+
+    def close(self):
+        self._process.stdin.close()
+        return_code = self._process.wait()
+
+        if self._pending:
+            raise Exception('Frames after {} were not written'.format(self._next_render_index))
+
+        if return_code:
+            raise subprocess.CalledProcessError(return_code, 'ffmpeg')
+
+
+class NullSink:
+    '''Throws frames away, to measure how fast they are rendered.'''
+    shareable = True
+    ordered = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    def frame_name(self, render_index):
+        return '{:05}'.format(render_index)
+
+    def start_at(self, render_index):
+        pass
+
+    def exists(self, job):
+        return False
+
+    def write(self, job, surface):
+        return 1
+
+    def close(self):
+        pass
+
+
+class ChecksumSink:
+    '''Records or checks a checksum of the pixels of each output frame.
+
+    The checksums are kept in a file with a line of "render_index
+    checksum" for each frame, like the manifest. Recording starts the
+    file over. When verifying, each frame is compared with the file and
+    closing the sink raises an error listing the first frames that
+    differ. Unless only a shard was rendered, frames in the file that
+    weren't rendered count as differing too.
+
+    Worker processes compute the checksum with the encoder function and
+    pass it back for write_data(), so nothing is encoded or written.
+    '''
+    shareable = False
+    ordered = False
+    encoder = staticmethod(frame_checksum)
+
+    def __init__(self, filename, verify=False):
+        if verify and not os.path.exists(filename):
+            raise ValueError('No checksums to verify in {}'.format(filename))
+
+        # Frames of an older, longer recording would be left over
+        if not verify and os.path.exists(filename):
+            os.remove(filename)
+
+        self._filename = filename
+        self._verify = verify
+        self._checksums = Manifest(filename)
+        self._lock = threading.Lock()
+        self._mismatches = []
+        self._checked = set()
+        self._partial = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type:
+            self._checksums.close()
+        else:
+            self.close()
+
+    def frame_name(self, render_index):
+        return '{}:{:05}'.format(self._filename, render_index)
+
+    def start_at(self, render_index):
+        self._partial = True
+
+    def exists(self, job):
+        return False
+
+    def write(self, job, surface):
+        return self.write_data(job, self.encoder(surface))
+
+    def write_data(self, job, data):
+        checksum = data.decode()
+
+        if not self._verify:
+            self._checksums.record(job.render_indexes, checksum)
+            return 1
+
+        with self._lock:
+            for render_index in job.render_indexes:
+                expected = self._checksums.get(render_index)
+                self._checked.add(render_index)
+
+                if expected != checksum:
+                    self._mismatches.append((render_index, expected, checksum))
+
+        return 1
+
+    def close(self):
+        self._checksums.close()
+
+        if not self._verify:
+            return
+
+        mismatches = list(self._mismatches)
+        num_frames = len(self._checked)
+
+        if not self._partial:
+            # Frames missing from the output are as wrong as changed ones
+            missing = set(self._checksums.render_indexes()) - self._checked
+            mismatches.extend(
+                (render_index, self._checksums.get(render_index), 'not rendered')
+                for render_index in missing
+            )
+            num_frames += len(missing)
+
+        if not mismatches:
+            return
+
+        mismatches.sort()
+        lines = [
+            '{:05}: expected {}, got {}'.format(render_index, expected or 'nothing', checksum)
+            for render_index, expected, checksum in mismatches[:MAX_REPORTED_MISMATCHES]
+        ]
+
+        raise Exception('{} of {} frames differ from {}, starting with:\n{}'.format(
+            len(mismatches), num_frames, self._filename, '\n'.join(lines)))
@@ -0,0 +1,506 @@
+'''Input screenshots and what is known about them
+
+A frame source is opened once in the main process and is then pickled
+into worker processes, so it only keeps plain data after opening.
+
+Sources provide:
+
+* open(): find the input frames.
+* len(source): the number of input frames.
+* load(index): the decoded screenshot, or None.
+* date(index): when the screenshot was taken.
+* fingerprints(): a string for each input frame that changes when the
+  screenshot changes.
+'''
+
+import array
+import concurrent.futures
+import datetime
+import os
+import sqlite3
+import subprocess
+import tempfile
+import threading
+import time
+
+from rendercore.cache import load_png
+from rendercore.catalog import load_catalog
+from rendercore.pixels import numpy
+from rendercore.verify import file_sha1
+
+try:
+    import arrow
+except ImportError:
+    arrow = None
+
+
+def file_fingerprint(root, name):
+    '''Return the name, size and modification time of the file under root.
+
+    The root is left out so the fingerprint doesn't change when the same
+    directory is given by a different path.
+    '''
+    try:
+        stat = os.stat(os.path.join(root, name))
+    except FileNotFoundError:
+        return '{} missing'.format(name)
+
+    return '{} {} {}'.format(name, stat.st_size, stat.st_mtime_ns)
+
+
+class DirectorySource:
+    '''PNG screenshots in a directory named by their Unix timestamp.'''
+    def __init__(self, input_dir):
+        self.input_dir = input_dir
+        self.filenames = ()
+
+    def open(self):
+        self.filenames = tuple(sorted(
+            os.path.basename(path) for path in os.listdir(self.input_dir)
+        ))
+
+    def __len__(self):
+        return len(self.filenames)
+
+    def load(self, index):
+        return load_png(os.path.join(self.input_dir, self.filenames[index]))
+
+    def date(self, index):
+        return datetime.datetime.fromtimestamp(
+            int(os.path.splitext(self.filenames[index])[0])
+        )
+
+    def fingerprints(self):
+        return tuple(
+            file_fingerprint(self.input_dir, filename)
+            for filename in self.filenames
+        )
+
+
+# How often worker processes check for a screenshot still being extracted
+EXTRACT_POLL_INTERVAL = 0.05
+
+EXTRACT_COMPLETE_FILENAME = '.complete'
+EXTRACT_FAILED_FILENAME = '.failed'
+
+# Screenshots that have to be out before rendering gets going: the first
+# frame's crossfade window and a bit
+STREAM_LAG_FRAMES = 30
+# Part of the archive streamed before them that is worth a warning
+STREAM_LAG_WARNING = 0.05
+
+
+class ArchiveSource:
+    '''PNG screenshots in a 7z archive dated by their modification time.
+
+    The screenshots are ordered by the number captured by order_pattern
+    from their path. When opened, the archive is streamed through
+    `7z e -so` in the background and each screenshot is written to the
+    extract directory as soon as it comes out, so rendering starts
+    without waiting for the whole archive. Loading a screenshot that
+    isn't out yet waits for it. 7z stores files in name order, so
+    unless the numbers are zero padded the first frames only come out
+    after much of the archive; see stream_lag().
+
+    The extract directory is temporary unless cache_dir is given. Then it
+    is cache_dir/cache_key and is reused without reading the archive
+    again once it is complete.
+
+    The archive listing comes from its catalog (see rendercore.catalog).
+    With expected_sha1, the archive is checked while it is being listed.
+    open_listing() only reads the listing, for when the screenshots come
+    from somewhere else, and extract() starts the extraction later. Until
+    then, only screenshots an earlier run left in the extract directory
+    are available.
+    '''
+    def __init__(self, archive_filename, order_pattern, cache_dir=None, cache_key=None,
+                 expected_sha1=None):
+        self.archive_filename = archive_filename
+        self.order_pattern = order_pattern
+        self.expected_sha1 = expected_sha1
+        self.entries = ()
+
+        if cache_dir:
+            self.extract_dir = os.path.join(
+                cache_dir, cache_key or os.path.basename(archive_filename))
+            os.makedirs(self.extract_dir, exist_ok=True)
+            self._temp_dir = None
+        else:
+            self._temp_dir = tempfile.TemporaryDirectory()
+            self.extract_dir = self._temp_dir.name
+
+        self._condition = threading.Condition()
+        self._archive_entries = ()
+        self._extracted = set()
+        self._extract_started = False
+        self._extract_finished = False
+        self._extract_error = None
+
+    def __getstate__(self):
+        # Worker processes watch the extract directory instead
+        return {
+            'archive_filename': self.archive_filename,
+            'order_pattern': self.order_pattern,
+            'entries': self.entries,
+            'extract_dir': self.extract_dir,
+            '_condition': None,
+        }
+
+    def open(self):
+        self.open_listing()
+        self.extract()
+
+    def open_listing(self):
+        print('Reading archive')
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+            if self.expected_sha1:
+                digest_future = executor.submit(file_sha1, self.archive_filename)
+
+            archive_entries = load_catalog(self.archive_filename, self.order_pattern)
+
+            if self.expected_sha1 and \
+                    digest_future.result().lower() != self.expected_sha1.lower():
+                raise ValueError('{} does not have the expected SHA-1 hash'.format(
+                    self.archive_filename))
+
+        self._archive_entries = archive_entries
+        self.entries = tuple(sorted(
+            (entry for entry in archive_entries if entry.frame_number is not None),
+            key=lambda entry: entry.frame_number
+        ))
+
+    def extract(self):
+        '''Start extracting the screenshots unless they already are.'''
+        if self._extract_started:
+            return
+
+        self._extract_started = True
+
+        if os.path.exists(os.path.join(self.extract_dir, EXTRACT_COMPLETE_FILENAME)):
+            print('Using extracted screenshots')
+            self._extracted = set(range(len(self.entries)))
+            self._extract_finished = True
+            return
+
+        failed_path = os.path.join(self.extract_dir, EXTRACT_FAILED_FILENAME)
+
+        if os.path.exists(failed_path):
+            os.remove(failed_path)
+
+        lag = self.stream_lag()
+
+        if lag > STREAM_LAG_WARNING:
+            print('The archive is not in frame order. The first screenshots are only '
+                  'extracted after {:.0%} of it, so rendering mostly waits for the '
+                  'extraction. Use --archive-cache to keep them for later runs.'.format(lag))
+
+        indexes = {entry.path: index for index, entry in enumerate(self.entries)}
+        thread = threading.Thread(target=self._extract, args=(self._archive_entries, indexes),
+                                  daemon=True)
+        thread.start()
+
+    def stream_lag(self, count=STREAM_LAG_FRAMES):
+        '''Return the part of the archive streamed before the first screenshots.
+
+        This is 0 to 1 by size, and close to 0 when the archive is in
+        frame order.
+        '''
+        total_size = sum(entry.size for entry in self._archive_entries)
+
+        if not total_size:
+            return 0
+
+        first_entries = self.entries[:count]
+        end = max((entry.offset + entry.size for entry in first_entries), default=0)
+
+        return max(0, end - sum(entry.size for entry in first_entries)) / total_size
+
+    def _extract(self, archive_entries, indexes):
+        # 7z writes the files one after the other in archive order
+        try:
+            process = subprocess.Popen(['7z', 'e', '-so', self.archive_filename],
+                                       stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+            with process:
+                for entry in archive_entries:
+                    data = _read_exactly(process.stdout, entry.size)
+                    index = indexes.get(entry.path)
+
+                    if index is None:
+                        continue
+
+                    path = self._frame_path(index)
+
+                    with open(path + '.tmp', 'wb') as file:
+                        file.write(data)
+
+                    os.replace(path + '.tmp', path)
+
+                    with self._condition:
+                        self._extracted.add(index)
+                        self._condition.notify_all()
+
+            if process.returncode:
+                raise subprocess.CalledProcessError(process.returncode, '7z')
+
+            open(os.path.join(self.extract_dir, EXTRACT_COMPLETE_FILENAME), 'w').close()
+        except Exception as error:
+            open(os.path.join(self.extract_dir, EXTRACT_FAILED_FILENAME), 'w').close()
+
+            with self._condition:
+                self._extract_error = error
+
+            raise
+        finally:
+            with self._condition:
+                self._extract_finished = True
+                self._condition.notify_all()
+
+    def _frame_path(self, index):
+        return os.path.join(self.extract_dir, '{}.png'.format(index))
+
+    def _wait_for(self, index):
+        if self._condition and not self._extract_started:
+            return
+        elif self._condition:
+            with self._condition:
+                self._condition.wait_for(
+                    lambda: index in self._extracted or self._extract_finished)
+
+                if self._extract_error:
+                    raise Exception('Extracting the archive failed') from self._extract_error
+
+            return
+
+        path = self._frame_path(index)
+
+        while not os.path.exists(path):
+            if os.path.exists(os.path.join(self.extract_dir, EXTRACT_FAILED_FILENAME)):
+                raise Exception('Extracting the archive failed')
+            elif os.path.exists(os.path.join(self.extract_dir, EXTRACT_COMPLETE_FILENAME)):
+                break
+
+            time.sleep(EXTRACT_POLL_INTERVAL)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def is_available(self, index):
+        '''Return whether the screenshot is extracted, so loading it won't wait.'''
+        if self._condition and self._extract_started:
+            with self._condition:
+                return index in self._extracted or self._extract_finished
+
+        return os.path.exists(self._frame_path(index))
+
+    def load(self, index):
+        self._wait_for(index)
+
+        return load_png(self._frame_path(index))
+
+    def date(self, index):
+        return self.entries[index].modified
+
+    def fingerprints(self):
+        return tuple('{} {}'.format(entry.path, entry.crc) for entry in self.entries)
+
+
+def _read_exactly(file, size):
+    data = file.read(size)
+
+    if len(data) != size:
+        raise EOFError('Archive ended early')
+
+    return data
+
+
+UTC_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def parse_dates_ms(date_strs):
+    '''Parse database dates into an array of milliseconds since the epoch.
+
+    Dates without a time zone are in UTC, as with arrow.get().
+    '''
+    if numpy:
+        try:
+            dates = numpy.array(date_strs, dtype='datetime64[ms]')
+        except ValueError:
+            pass
+        else:
+            return array.array('q', dates.astype(numpy.int64).tobytes())
+
+    timestamps = array.array('q')
+
+    for date_str in date_strs:
+        try:
+            date = datetime.datetime.fromisoformat(date_str)
+        except ValueError:
+            if not arrow:
+                raise ValueError('arrow is required to read the date {}'.format(date_str))
+
+            date = arrow.get(date_str).datetime
+
+        if date.tzinfo is None:
+            date = date.replace(tzinfo=datetime.timezone.utc)
+
+        timestamps.append((date - UTC_EPOCH) // datetime.timedelta(milliseconds=1))
+
+    return timestamps
+
+
+class InputDatabaseSource:
+    '''Screenshots taken for each input in a pmd_inputs database table.
+
+    Input N has its screenshot at NN/0000N.png in the images directory, or
+    at NN/0000N.v.png if it was recovered from a stream VOD instead.
+
+    The rows are kept as columns: the input IDs and dates in integer
+    arrays and the votes as indexes into a tuple of the distinct votes.
+    Dates are turned into datetimes only when asked for.
+
+    The images directory is listed once when opened. Which screenshots
+    exist and which are from a VOD are kept as bitmaps, so finding a
+    screenshot doesn't touch the disk.
+    '''
+    def __init__(self, images_dir, database_filename):
+        self.images_dir = images_dir
+        self.database_filename = database_filename
+        self.input_ids = array.array('q')
+        self.timestamps_ms = array.array('q')
+        self.vote_names = ()
+        self.vote_codes = array.array('H')
+        self.present = bytearray()
+        self.vod = bytearray()
+
+    def open(self):
+        database = sqlite3.connect(self.database_filename)
+
+        try:
+            rows = database.execute('''
+                SELECT id, date, input FROM pmd_inputs ORDER BY ID
+            ''').fetchall()
+        finally:
+            database.close()
+
+        if rows:
+            input_ids, date_strs, input_votes = zip(*rows)
+        else:
+            input_ids, date_strs, input_votes = (), (), ()
+
+        vote_codes = {}
+
+        self.input_ids = array.array('q', input_ids)
+        self.timestamps_ms = parse_dates_ms(date_strs)
+        self.vote_codes = array.array('H', (
+            vote_codes.setdefault(input_vote, len(vote_codes)) for input_vote in input_votes
+        ))
+        self.vote_names = tuple(vote_codes)
+
+        self._index_images()
+
+    def _index_images(self):
+        count = len(self.input_ids)
+        present = bytearray((count + 7) // 8)
+        vod = bytearray((count + 7) // 8)
+
+        for shard in range(count // 1000 + 1):
+            shard_name = '{:02d}'.format(shard)
+
+            try:
+                dir_entries = list(os.scandir(os.path.join(self.images_dir, shard_name)))
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+
+            for dir_entry in dir_entries:
+                name = dir_entry.name
+
+                if name.endswith('.v.png'):
+                    stem, is_vod = name[:-6], True
+                elif name.endswith('.png'):
+                    stem, is_vod = name[:-4], False
+                else:
+                    continue
+
+                if not stem.isdigit():
+                    continue
+
+                frame_id = int(stem)
+                index = frame_id - 1
+
+                if not 0 <= index < count or stem != '{:05d}'.format(frame_id) or \
+                        shard_name != '{:02d}'.format(frame_id // 1000):
+                    continue
+
+                if not is_vod:
+                    _set_bit(present, index)
+                    _clear_bit(vod, index)
+                elif not _get_bit(present, index):
+                    # Only if there is no regular screenshot
+                    _set_bit(present, index)
+                    _set_bit(vod, index)
+
+        self.present = present
+        self.vod = vod
+
+    def __len__(self):
+        return len(self.input_ids)
+
+    def image_name(self, index):
+        '''Return the screenshot's path within the images directory, or None.'''
+        if not _get_bit(self.present, index):
+            return None
+
+        frame_id = index + 1
+        suffix = '.v.png' if _get_bit(self.vod, index) else '.png'
+
+        return os.path.join('{:02d}'.format(frame_id // 1000),
+                            '{:05d}{}'.format(frame_id, suffix))
+
+    def image_path(self, index):
+        image_name = self.image_name(index)
+
+        if image_name:
+            return os.path.join(self.images_dir, image_name)
+
+    def is_vod_screenshot(self, index):
+        '''Return whether the screenshot was recovered from a stream VOD.'''
+        return _get_bit(self.present, index) and _get_bit(self.vod, index)
+
+    def load(self, index):
+        input_path = self.image_path(index)
+
+        if input_path:
+            return load_png(input_path)
+
+    def date(self, index):
+        return UTC_EPOCH + datetime.timedelta(milliseconds=self.timestamps_ms[index])
+
+    def input_vote(self, index):
+        return self.vote_names[self.vote_codes[index]]
+
+    def fingerprints(self):
+        fingerprints = []
+
+        for index in range(len(self.input_ids)):
+            image_name = self.image_name(index)
+
+            if image_name:
+                fingerprints.append(file_fingerprint(self.images_dir, image_name))
+            else:
+                fingerprints.append('{} missing'.format(self.input_ids[index]))
+
+        return tuple(fingerprints)
+
+
+def _get_bit(bitmap, index):
+    return bool(bitmap[index >> 3] & (1 << (index & 7)))
+
+
+def _set_bit(bitmap, index):
+    bitmap[index >> 3] |= 1 << (index & 7)
+
+
+def _clear_bit(bitmap, index):
+    bitmap[index >> 3] &= ~(1 << (index & 7)) & 0xff
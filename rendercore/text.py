@@ -0,0 +1,227 @@
+'''Text drawn on the output frames'''
+
+import functools
+import logging
+import math
+import threading
+
+import cairo
+
+from rendercore.layout import line_y
+
+FONT_NAME = 'Nimbus Sans L'
+FONT_NAME_SYMBOL = 'Symbola'
+
+# Extra pixels around a glyph for antialiasing outside its ink extents
+GLYPH_MARGIN = 2
+# Number of positions within a pixel cairo's image backend places glyphs
+# at: quarter pixels since cairo 1.17.4, whole pixels before
+SUBPIXEL_PHASE_COUNTS = (4, 1)
+SUBPIXEL_POSITIONING_VERSION = 11704
+# Fractions of a pixel the atlas is compared with show_text() at
+CHECK_OFFSETS = (0, 0.25, 1 / 3, 0.5, 0.75)
+
+
+@functools.lru_cache()
+def get_atlas(font_name, size):
+    return GlyphAtlas(font_name, size)
+
+
+class GlyphAtlas:
+    '''Glyphs of a font rasterized once and painted as masks.
+
+    The info lines are redrawn on every frame but only use a handful of
+    characters, so each glyph is laid out and rasterized the first time
+    it is used and painted from then on.
+
+    Text drawn on image surfaces has its glyphs placed by their advance
+    without kerning, rounded to a whole pixel or, in newer cairo, to a
+    quarter pixel. Each glyph is rasterized once for each position
+    within a pixel it is drawn at. The first text drawn is also drawn
+    with show_text() at a few fractional positions to find which
+    rounding the cairo in use has. If neither gives the same pixels,
+    text is drawn with show_text() instead. The context must not be
+    transformed.
+    '''
+    def __init__(self, font_name, size):
+        self._font_name = font_name
+        self._size = size
+        self._lock = threading.Lock()
+        self._scaled_font = None
+        self._phases = None
+        self._glyphs = {}
+
+    def show_text(self, context, x, y, text):
+        '''Paint text in the current source. Returns the x after the text.'''
+        with self._lock:
+            if not self._scaled_font:
+                self._scaled_font = self._get_scaled_font(context)
+                self._phases = self._find_phases(text)
+
+            if not self._phases:
+                glyphs = None
+            else:
+                glyphs, x = self._layout(x, y, text, self._phases)
+
+        if glyphs is None:
+            return self._show_text(context, x, y, text)
+
+        _paint_glyphs(context, glyphs)
+
+        return x
+
+    def _layout(self, x, y, text, phases):
+        # Returns the masks with their positions and the x after the text
+        pixel_y, phase_y = _split_position(y, phases)
+        glyphs = []
+
+        for char in text:
+            pixel_x, phase_x = _split_position(x, phases)
+            key = (char, phase_x, phase_y)
+            glyph = self._glyphs.get(key)
+
+            if not glyph:
+                glyph = self._glyphs[key] = self._render(char, phase_x, phase_y)
+
+            surface, left, top, advance = glyph
+            glyphs.append((surface, pixel_x + left, pixel_y + top))
+            x += advance
+
+        return glyphs, x
+
+    def _show_text(self, context, x, y, text):
+        context.save()
+        context.select_font_face(self._font_name)
+        context.set_font_size(self._size)
+        context.move_to(x, y)
+        context.show_text(text)
+        x = context.get_current_point()[0]
+        context.new_path()
+        context.restore()
+
+        return x
+
+    def _find_phases(self, text):
+        if cairo.cairo_version() >= SUBPIXEL_POSITIONING_VERSION:
+            phase_counts = SUBPIXEL_PHASE_COUNTS
+        else:
+            phase_counts = tuple(reversed(SUBPIXEL_PHASE_COUNTS))
+
+        for phases in phase_counts:
+            if all(self._matches_show_text(text, phases, offset) for offset in CHECK_OFFSETS):
+                return phases
+
+        logging.warning('Cached glyphs of %s don\'t match cairo %s, drawing text directly',
+                        self._font_name, cairo.cairo_version_string())
+
+    def _matches_show_text(self, text, phases, offset):
+        '''Return whether the atlas draws the text like show_text().'''
+        advance = self._scaled_font.text_extents(text)[4]
+        width = math.ceil(abs(advance) + self._size * 2)
+        height = math.ceil(self._size * 3)
+        x = self._size + offset
+        y = self._size * 2 + offset
+        pixels = []
+
+        for use_atlas in (True, False):
+            surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
+            context = cairo.Context(surface)
+            context.set_source_rgb(1.0, 1.0, 1.0)
+
+            if use_atlas:
+                _paint_glyphs(context, self._layout(x, y, text, phases)[0])
+            else:
+                self._show_text(context, x, y, text)
+
+            surface.flush()
+            pixels.append(bytes(surface.get_data()))
+
+        return pixels[0] == pixels[1]
+
+    def _get_scaled_font(self, context):
+        # Font options come from the target surface so the glyphs
+        # are hinted the same way as text drawn directly
+        context.save()
+        context.select_font_face(self._font_name)
+        context.set_font_size(self._size)
+        scaled_font = context.get_scaled_font()
+        context.restore()
+
+        return scaled_font
+
+    def _render(self, char, phase_x, phase_y):
+        x_bearing, y_bearing, width, height, x_advance = \
+            self._scaled_font.text_extents(char)[:5]
+
+        if width <= 0 or height <= 0:
+            return None, 0, 0, x_advance
+
+        left = math.floor(x_bearing) - GLYPH_MARGIN
+        top = math.floor(y_bearing) - GLYPH_MARGIN
+        right = math.ceil(x_bearing + width) + GLYPH_MARGIN + 1
+        bottom = math.ceil(y_bearing + height) + GLYPH_MARGIN + 1
+
+        surface = cairo.ImageSurface(cairo.FORMAT_A8, right - left, bottom - top)
+        context = cairo.Context(surface)
+        context.set_scaled_font(self._scaled_font)
+        context.move_to(-left + phase_x, -top + phase_y)
+        context.show_text(char)
+        surface.flush()
+
+        return surface, left, top, x_advance
+
+
+def _split_position(position, phases):
+    '''Round to a subpixel phase and return the whole pixel and the phase.'''
+    steps = math.floor(position * phases + 0.5)
+    pixel = steps // phases
+
+    return pixel, (steps - pixel * phases) / phases
+
+
+def _paint_glyphs(context, glyphs):
+    for surface, glyph_x, glyph_y in glyphs:
+        if surface is not None:
+            context.mask_surface(surface, glyph_x, glyph_y)
+
+
+def format_duration(delta):
+    days, remainder = divmod(int(delta.total_seconds()), 86400)
+    hours, remainder = divmod(remainder, 3600)
+    minutes, seconds = divmod(remainder, 60)
+
+    return ' {days:03}d {hours:02}h {minutes:02}m {seconds:02}s'.format(
+        days=days,
+        hours=hours,
+        minutes=minutes,
+        seconds=seconds
+    )
+
+
+def draw_title(context, layout, text):
+    context.save()
+    context.set_source_rgb(1.0, 1.0, 1.0)
+    context.select_font_face(FONT_NAME, cairo.FONT_SLANT_NORMAL,
+                             cairo.FONT_WEIGHT_BOLD)
+    context.set_font_size(layout.title_text_size)
+
+    if layout.title_centered:
+        title_x = layout.title_x - context.get_scaled_font().text_extents(text)[2] / 2
+    else:
+        title_x = layout.title_x
+
+    context.move_to(title_x, layout.title_y)
+    context.show_text(text)
+    context.restore()
+
+
+def draw_info_line(context, layout, line, symbol, text):
+    '''Draw a symbol followed by text on a line of the sidebar.'''
+    y = line_y(layout, line)
+
+    context.save()
+    context.set_source_rgb(1.0, 1.0, 1.0)
+    x = get_atlas(FONT_NAME_SYMBOL, layout.info_text_size).show_text(
+        context, layout.sidebar_x, y, symbol)
+    get_atlas(FONT_NAME, layout.info_text_size).show_text(context, x, y, text)
+    context.restore()
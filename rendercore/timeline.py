@@ -0,0 +1,111 @@
+'''Planning which input frame is shown in each output frame'''
+
+import collections
+import itertools
+
+import cairo
+
+# Composites are full size frames so only keep the few that are being
+# reused, such as the held last frame during the ending fade
+COMPOSITE_CACHE_SIZE = 4
+
+FrameJob = collections.namedtuple('FrameJob', [
+    'input_index', 'render_indexes', 'alpha', 'digest', 'overlay_state', 'info_lines'
+])
+'''Output frames rendered from a single composite.
+
+The first render index is rendered and the others are copies of it.
+The digest identifies everything the frames are rendered from, if known.
+Once the job is planned, it also carries the overlay state and the info
+text of its input so workers don't have to work them out again.
+'''
+FrameJob.__new__.__defaults__ = (None, None, None)
+
+
+def build_timeline(num_input_frames, fps, stride=1):
+    '''Return the input index shown in each output frame.
+
+    The first input frame is held for a second and the last one for five.
+    With a stride, only every stride-th input frame is shown.
+    '''
+    input_indexes = range(0, num_input_frames, stride)
+
+    return tuple(itertools.chain(
+        itertools.repeat(input_indexes[0], fps),
+        input_indexes,
+        itertools.repeat(input_indexes[-1], fps * 5),
+    ))
+
+
+def fade_out_alpha(render_index, total_render_frames, fps):
+    if render_index > total_render_frames - 1 - fps:
+        return (total_render_frames - 1 - render_index) / fps
+    else:
+        return 1.0
+
+
+def plan_jobs(timeline, fps):
+    '''Group output frames that would render to the same image.
+
+    Consecutive output frames showing the same input at full opacity
+    become a single job. Frames in the ending fade get a job each.
+    '''
+    total_render_frames = len(timeline)
+    render_indexes = range(total_render_frames)
+
+    for input_index, group in itertools.groupby(render_indexes, key=timeline.__getitem__):
+        held_indexes = []
+
+        for render_index in group:
+            alpha = fade_out_alpha(render_index, total_render_frames, fps)
+
+            if alpha == 1.0:
+                held_indexes.append(render_index)
+                continue
+
+            if held_indexes:
+                yield FrameJob(input_index, tuple(held_indexes), 1.0)
+                held_indexes = []
+
+            yield FrameJob(input_index, (render_index,), alpha)
+
+        if held_indexes:
+            yield FrameJob(input_index, tuple(held_indexes), 1.0)
+
+
+def shard_range(total_render_frames, shard_index, num_shards):
+    '''Return the start and end render index of a contiguous shard.'''
+    return (total_render_frames * shard_index // num_shards,
+            total_render_frames * (shard_index + 1) // num_shards)
+
+
+def shard_jobs(jobs, start, end):
+    '''Keep the jobs, or parts of jobs, rendering frames in start:end.'''
+    for job in jobs:
+        render_indexes = tuple(
+            render_index for render_index in job.render_indexes
+            if start <= render_index < end
+        )
+
+        if render_indexes:
+            yield job._replace(render_indexes=render_indexes)
+
+
+def apply_fade(composite, alpha):
+    '''Paint a composite onto a black frame with the given opacity.'''
+    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, composite.get_width(), composite.get_height())
+    context = cairo.Context(surface)
+
+    context.set_source_rgb(0.0, 0.0, 0.0)
+    context.paint()
+
+    context.set_source_surface(composite, 0, 0)
+
+    if alpha == 1.0:
+        context.paint()
+    else:
+        context.paint_with_alpha(alpha)
+
+    surface.flush()
+
+    return surface
@@ -0,0 +1,89 @@
+'''Scaling screenshots up by whole numbers without cairo'''
+
+import threading
+
+import cairo
+
+from rendercore.pixels import numpy, surface_pixels
+
+
+def integer_factor(scale):
+    '''Return the scale as an int if it is a whole number, otherwise None.'''
+    if scale >= 1 and float(scale).is_integer():
+        return int(scale)
+
+
+def replicate_pixels(pixels, out, factor, opaque=False):
+    '''Write each pixel as a factor by factor block into out.
+
+    Both are (height, width, 4) views of ARGB32 pixels. With opaque, the
+    alpha of the copies is set to 255.
+    '''
+    height, width = pixels.shape[:2]
+    colors = pixels.view(numpy.uint32)[:, :, 0]
+
+    if opaque:
+        colors = colors | numpy.uint32(0xff000000)
+
+    # Repeat along the rows first, then copy each row factor times.
+    # Splitting the axes of out is always a view, so this writes into it.
+    rows = numpy.repeat(colors, factor, axis=1)
+    out.view(numpy.uint32)[:, :, 0].reshape(height, factor, width * factor)[:] = rows[:, None, :]
+
+
+class NearestUpscaler:
+    '''Paints surfaces scaled up by a whole number by copying pixels.
+
+    The result is the same as painting with a scale transform and
+    FILTER_NEAREST: at a whole scale and position each output pixel
+    center falls inside exactly one input pixel. Opaque screenshots are
+    copied straight into the frame. Those with alpha are copied into a
+    surface that each thread reuses and painted unscaled.
+
+    paint() returns False when it can't be used, such as without NumPy
+    or at a fractional scale or position, so cairo can paint instead.
+    '''
+    def __init__(self):
+        self._local = threading.local()
+
+    def paint(self, context, target, source, x, y, scale):
+        factor = integer_factor(scale)
+
+        if not numpy or not factor or not float(x).is_integer() or not float(y).is_integer() or \
+                source.get_format() not in (cairo.FORMAT_ARGB32, cairo.FORMAT_RGB24) or \
+                target.get_format() != cairo.FORMAT_ARGB32:
+            return False
+
+        x, y = int(x), int(y)
+        width = source.get_width() * factor
+        height = source.get_height() * factor
+
+        if x < 0 or y < 0 or x + width > target.get_width() or y + height > target.get_height():
+            return False
+
+        pixels = surface_pixels(source)
+
+        if source.get_format() == cairo.FORMAT_RGB24:
+            region = surface_pixels(target)[y:y + height, x:x + width]
+            replicate_pixels(pixels, region, factor, opaque=True)
+            target.mark_dirty_rectangle(x, y, width, height)
+            return True
+
+        scaled = self._buffer(width, height)
+        replicate_pixels(pixels, surface_pixels(scaled), factor)
+        scaled.mark_dirty()
+
+        context.save()
+        context.set_source_surface(scaled, x, y)
+        context.paint()
+        context.restore()
+
+        return True
+
+    def _buffer(self, width, height):
+        buffer = getattr(self._local, 'buffer', None)
+
+        if not buffer or buffer.get_width() != width or buffer.get_height() != height:
+            buffer = self._local.buffer = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
+
+        return buffer
@@ -0,0 +1,62 @@
+'''Checking archives against their published hashes'''
+
+import hashlib
+import json
+import os
+
+HASH_BUFFER_SIZE = 8 * 1024 * 1024
+STAMP_SUFFIX = '.verified'
+
+
+def hash_file(filename, algorithm='sha1'):
+    '''Hash a file reading it in large blocks.'''
+    hasher = hashlib.new(algorithm)
+    buffer = bytearray(HASH_BUFFER_SIZE)
+    view = memoryview(buffer)
+
+    with open(filename, 'rb', buffering=0) as file:
+        while True:
+            size = file.readinto(buffer)
+
+            if not size:
+                break
+
+            hasher.update(view[:size])
+
+    return hasher.hexdigest()
+
+
+def _file_identity(stat):
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'inode': stat.st_ino}
+
+
+def file_sha1(filename):
+    '''Return the SHA-1 of a file, hashing it only if it changed.
+
+    The digest is remembered in a stamp file next to it along with the
+    size, modification time and inode it was computed for.
+    '''
+    stamp_filename = filename + STAMP_SUFFIX
+    identity = _file_identity(os.stat(filename))
+
+    try:
+        with open(stamp_filename) as file:
+            stamp = json.load(file)
+    except (OSError, ValueError):
+        stamp = None
+
+    if stamp and stamp.get('file') == identity and stamp.get('sha1'):
+        return stamp['sha1']
+
+    digest = hash_file(filename)
+
+    try:
+        with open(stamp_filename + '.tmp', 'w') as file:
+            json.dump({'file': identity, 'sha1': digest}, file)
+
+        os.replace(stamp_filename + '.tmp', stamp_filename)
+    except OSError:
+        # Such as when the archive is on a read only disk
+        pass
+
+    return digest